@@ -47,4 +47,28 @@ def calculate_angle(a, b, c):
 
     except Exception as e:
         print(f"[calculate_angle] Failed to compute angle: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def calculate_angles(a, b, c):
+    """
+    Vectorised version of calculate_angle for N triplets of 2D points.
+
+    Parameters
+    ----------
+    a, b, c : np.ndarray, shape (N, 2)
+        First points, vertices and third points of each triplet.
+
+    Returns
+    -------
+    np.ndarray, shape (N,)
+        Angles in degrees between BA and BC. NaN where a segment has
+        zero length or an input point is NaN.
+    """
+    ba = a - b
+    bc = c - b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cosine = np.einsum("ij,ij->i", ba, bc) / (
+            np.linalg.norm(ba, axis=1) * np.linalg.norm(bc, axis=1)
+        )
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
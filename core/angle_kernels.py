@@ -0,0 +1,51 @@
+"""
+Kernel de ángulos articulares por frame.
+Usa Numba si está instalado y el cálculo vectorizado de NumPy en caso contrario.
+"""
+
+import math
+
+import numpy as np
+
+from core.angle_calculator import calculate_angles
+
+try:
+    from numba import njit
+    _NUMBA_OK = True
+except ImportError:
+    _NUMBA_OK = False
+
+# Brazo D, brazo I, pierna D, pierna I sobre los 12 primeros puntos.
+ANGLE_TRIPLETS = np.array(
+    [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10, 11]], dtype=np.int64
+)
+
+if _NUMBA_OK:
+    # Sin los flags nnan/ninf para conservar NaN en tramos degenerados.
+    @njit(cache=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+    def _four_angles(pts, triplets):
+        out = np.empty(triplets.shape[0])
+        for i in range(triplets.shape[0]):
+            a, b, c = triplets[i, 0], triplets[i, 1], triplets[i, 2]
+            bax = pts[a, 0] - pts[b, 0]
+            bay = pts[a, 1] - pts[b, 1]
+            bcx = pts[c, 0] - pts[b, 0]
+            bcy = pts[c, 1] - pts[b, 1]
+            denom = math.sqrt((bax * bax + bay * bay) * (bcx * bcx + bcy * bcy))
+            if not denom > 0.0:
+                out[i] = np.nan
+                continue
+            cosine = min(1.0, max(-1.0, (bax * bcx + bay * bcy) / denom))
+            out[i] = math.degrees(math.acos(cosine))
+        return out
+
+
+def four_angles(pts: np.ndarray) -> np.ndarray:
+    if _NUMBA_OK:
+        return _four_angles(pts, ANGLE_TRIPLETS)
+    triplets = pts[:12].reshape(4, 3, 2)
+    return calculate_angles(triplets[:, 0], triplets[:, 1], triplets[:, 2])
+
+
+def warm_up() -> None:
+    four_angles(np.zeros((12, 2), dtype=np.float64))
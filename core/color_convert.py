@@ -0,0 +1,60 @@
+"""
+Conversión BGR -> YUV420 (I420) para los writers de FFmpeg.
+Usa libyuv si está instalada en el sistema y OpenCV en caso contrario.
+"""
+
+import ctypes
+import ctypes.util
+
+import cv2
+import numpy as np
+
+try:
+    _libyuv = ctypes.CDLL(ctypes.util.find_library("yuv") or "libyuv.so")
+    _u8p = ctypes.POINTER(ctypes.c_uint8)
+    _libyuv.RGB24ToI420.argtypes = [
+        _u8p, ctypes.c_int,
+        _u8p, ctypes.c_int,
+        _u8p, ctypes.c_int,
+        _u8p, ctypes.c_int,
+        ctypes.c_int, ctypes.c_int,
+    ]
+    _libyuv.RGB24ToI420.restype = ctypes.c_int
+    _LIBYUV_OK = True
+except (OSError, AttributeError):
+    _libyuv = None
+    _LIBYUV_OK = False
+
+
+def _ptr(arr: np.ndarray):
+    return arr.ctypes.data_as(_u8p)
+
+
+def _rows_packed(frame: np.ndarray) -> bool:
+    return (
+        frame.dtype == np.uint8
+        and frame.ndim == 3
+        and frame.strides[2] == 1
+        and frame.strides[1] == 3
+    )
+
+
+def bgr_to_i420(frame: np.ndarray, dst: bytearray) -> None:
+    h, w = frame.shape[:2]
+    yuv = np.frombuffer(dst, dtype=np.uint8).reshape(h * 3 // 2, w)
+
+    if _LIBYUV_OK and _rows_packed(frame):
+        flat = yuv.reshape(-1)
+        y_size = w * h
+        c_size = y_size // 4
+        ret = _libyuv.RGB24ToI420(
+            _ptr(frame), frame.strides[0],
+            _ptr(flat[:y_size]), w,
+            _ptr(flat[y_size:y_size + c_size]), w // 2,
+            _ptr(flat[y_size + c_size:]), w // 2,
+            w, h,
+        )
+        if ret == 0:
+            return
+
+    cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=yuv)
@@ -0,0 +1,183 @@
+"""
+Overlays de sesión como ficheros sidecar para Recon IA.
+Guarda landmarks y ángulos por frame junto al vídeo RAW y regenera
+las versiones MediaPipe/clínica bajo demanda.
+"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterator
+
+import cv2
+import numpy as np
+
+from core.color_convert import bgr_to_i420
+from core.legacy_overlay import draw_legacy_overlay
+from core.logger import get_logger
+
+log = get_logger("core.overlay")
+
+OVERLAY_KINDS = ("mediapipe", "legacy")
+
+
+class OverlaySidecarWriter:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = gzip.open(path, "wt", encoding="utf-8")
+        self.records_written = 0
+
+    def write(
+        self,
+        frame_index: int,
+        sequence: int,
+        landmarks: Dict[str, Any] | None,
+        angles: Dict[str, Any] | None,
+    ) -> None:
+        record = {
+            "frame": frame_index,
+            "sequence": sequence,
+            "landmarks": {k: list(v) for k, v in (landmarks or {}).items()},
+            "angles": angles or {},
+        }
+        self._fh.write(json.dumps(record, separators=(",", ":")))
+        self._fh.write("\n")
+        self.records_written += 1
+
+    def close(self) -> None:
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+
+def read_overlay_sidecar(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _draw_sequence(image_bgr, sequence: int) -> None:
+    cv2.rectangle(image_bgr, (15, 5), (250, 40), (250, 250, 250), -1)
+    cv2.putText(image_bgr, f'Secuencia: {sequence}', (20, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 1, cv2.LINE_AA)
+
+
+def _draw_mediapipe(width: int, height: int, landmarks: dict, sequence: int):
+    import mediapipe as mp
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    if landmarks:
+        names = [lm.name for lm in mp.solutions.pose.PoseLandmark]
+        points = {
+            idx: (int(landmarks[name][0] * width), int(landmarks[name][1] * height))
+            for idx, name in enumerate(names) if name in landmarks
+        }
+        for a, b in mp.solutions.pose.POSE_CONNECTIONS:
+            if a in points and b in points:
+                cv2.line(image, points[a], points[b], (0, 255, 0), 2)
+        for pt in points.values():
+            cv2.circle(image, pt, 2, (0, 0, 255), -1)
+    _draw_sequence(image, sequence)
+    return image
+
+
+class _H264Output:
+    # Mismo camino H.264 que las sesiones (pipe FFmpeg) para que el vídeo
+    # regenerado se reproduzca en el navegador; mp4v solo como último recurso.
+
+    def __init__(self, output_path: str, fps: int, width: int, height: int):
+        from core.session_manager import SessionManager, _PipeWriter
+        from core.video_capture import _open_writer
+
+        self._frame_size = width * height * 3 // 2
+        self._pipe = None
+        self._writer = None
+        encoder = SessionManager(
+            output_dir=os.path.dirname(os.path.abspath(output_path)), realtime=False
+        )
+        self._process = encoder._create_ffmpeg_writer(output_path, width, height, fps)
+        if self._process is not None:
+            self._pipe = _PipeWriter(self._process, "overlay", self._frame_size, realtime=False)
+            return
+
+        codec, self._writer = _open_writer(output_path, fps, (width, height))
+        if self._writer is None:
+            raise RuntimeError(f"No se pudo crear el vídeo de salida: {output_path}")
+        if codec == "mp4v":
+            log.warning("Sin encoder H.264 disponible; %s puede no reproducirse en el navegador", output_path)
+
+    def write(self, frame) -> None:
+        if self._writer is not None:
+            self._writer.write(frame)
+            return
+        buf = self._pipe.acquire(self._frame_size)
+        if buf is None or self._pipe.broken:
+            raise RuntimeError("FFmpeg no acepta más frames del overlay regenerado")
+        bgr_to_i420(frame, buf)
+        if not self._pipe.submit(buf):
+            raise RuntimeError("FFmpeg no acepta más frames del overlay regenerado")
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.release()
+            return
+        self._pipe.stop()
+        self._process.stdin.close()
+        code = self._process.wait(timeout=60)
+        if self._pipe.broken or code != 0:
+            raise RuntimeError(f"FFmpeg falló al regenerar el overlay (code={code})")
+
+
+def render_overlay_video(
+    raw_video_path: str,
+    sidecar_path: str,
+    output_path: str,
+    kind: str = "legacy",
+) -> int:
+    if kind not in OVERLAY_KINDS:
+        raise ValueError(f"Tipo de overlay inválido: {kind}. Use 'mediapipe' o 'legacy'")
+
+    cap = cv2.VideoCapture(raw_video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"No se pudo abrir el vídeo base: {raw_video_path}")
+
+    fps = round(cap.get(cv2.CAP_PROP_FPS)) or 20
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    try:
+        writer = _H264Output(output_path, fps, width, height)
+    except Exception:
+        cap.release()
+        raise
+
+    rendered = 0
+    try:
+        for record in read_overlay_sidecar(sidecar_path):
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            lm = record.get("landmarks") or {}
+            sequence = record.get("sequence", rendered)
+            if kind == "mediapipe":
+                frame = _draw_mediapipe(width, height, lm, sequence)
+            elif lm:
+                frame = draw_legacy_overlay(
+                    frame, lm, width, height,
+                    angles=record.get("angles") or {},
+                    a_max=60.0,
+                    sequence=sequence
+                )
+            else:
+                _draw_sequence(frame, sequence)
+
+            writer.write(frame)
+            rendered += 1
+    finally:
+        cap.release()
+        writer.close()
+
+    log.info("render_overlay_video: %s frames (%s) -> %s", rendered, kind, output_path)
+    return rendered
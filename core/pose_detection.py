@@ -3,6 +3,10 @@ import mediapipe as mp
 import numpy as np
 from typing import Dict, Tuple, Any
 
+LANDMARK_NAMES = tuple(lm.name for lm in mp.solutions.pose.PoseLandmark)
+LANDMARK_INDEX = {lm.name: lm.value for lm in mp.solutions.pose.PoseLandmark}
+
+
 class PoseDetector:
     
     def __init__(
@@ -24,27 +28,31 @@ class PoseDetector:
             min_detection_confidence=min_detection_confidence,
             min_tracking_confidence=min_tracking_confidence
         )
+        self._lm_buf = np.empty((len(LANDMARK_NAMES), 4), dtype=np.float64)
     
     def process_frame(self, frame_bgr) -> Tuple[Any, Any]:
         frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
         results = self.pose.process(frame_rgb)
         return frame_bgr, results
     
-    def extract_landmarks(self, results) -> Dict[str, Tuple[float, float, float, float]]:
+    def landmark_array(self, results) -> np.ndarray | None:
         if not results or not results.pose_landmarks:
-            return {}
-        
-        landmarks_dict = {}
-        for idx, landmark in enumerate(results.pose_landmarks.landmark):
-            landmark_name = self.mp_pose.PoseLandmark(idx).name
-            landmarks_dict[landmark_name] = (
-                landmark.x,
-                landmark.y,
-                landmark.z,
-                landmark.visibility
-            )
+            return None
         
-        return landmarks_dict
+        # Buffer reutilizado: solo es válido hasta el siguiente frame.
+        self._lm_buf[:] = [
+            (landmark.x, landmark.y, landmark.z, landmark.visibility)
+            for landmark in results.pose_landmarks.landmark
+        ]
+        return self._lm_buf
+    
+    def landmarks_to_dict(self, landmarks: np.ndarray | None) -> Dict[str, Tuple[float, float, float, float]]:
+        if landmarks is None:
+            return {}
+        return dict(zip(LANDMARK_NAMES, map(tuple, landmarks.tolist())))
+    
+    def extract_landmarks(self, results) -> Dict[str, Tuple[float, float, float, float]]:
+        return self.landmarks_to_dict(self.landmark_array(results))
     
     def draw_landmarks(self, image, results, sequence: int = None) -> Any:
         if results and results.pose_landmarks:
@@ -1,18 +1,221 @@
+import logging
 import os
+import sys
 import time
-import math
 import cv2
 import subprocess
+import tempfile
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 import numpy as np
+from pathlib import Path
 from typing import Dict, List, Tuple
 
 from core.utils import timestamp
 from core.path_manager import get_exports_dir, check_disk_space
+from core.overlay_renderer import OverlaySidecarWriter
+from core.color_convert import bgr_to_i420
 from db import crud
 from core.logger import get_logger
 
 log = get_logger("core.session")
 
+QUALITY_MODES = ("crf", "cbr", "lossless")
+HW_ENCODERS = ("h264_nvenc", "hevc_nvenc", "h264_videotoolbox")
+ENCODERS = ("auto", "libx264") + HW_ENCODERS
+PIPE_BUFFER_SIZE = 1 << 20
+PIPE_QUEUE_SIZE = 8
+PIPE_WRITEV_MAX = 4
+PIPE_BLOCK_TIMEOUT = 30.0
+DB_FLUSH_ROWS = 64
+DB_FLUSH_SECONDS = 1.0
+DB_LOG_SECONDS = 30.0
+MIN_FREE_DISK_MB = 100
+DISK_CHECK_SECONDS = 10.0
+
+FOURCC_OPTIONS = (
+    ('H264', cv2.VideoWriter_fourcc(*'H264')),
+    ('X264', cv2.VideoWriter_fourcc(*'X264')),
+    ('avc1', cv2.VideoWriter_fourcc(*'avc1')),
+    ('mp4v', cv2.VideoWriter_fourcc(*'mp4v')),
+)
+
+
+def _scale_bitrate(bitrate: str, factor: int) -> str:
+    value = bitrate.strip()
+    suffix = value[-1] if value and value[-1] in "kKmM" else ""
+    number = float(value[:-1] if suffix else value)
+    return f"{int(number * factor)}{suffix}"
+
+
+@lru_cache(maxsize=None)
+def _encoder_usable(encoder: str) -> bool:
+    try:
+        result = subprocess.run(
+            [
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-f', 'lavfi', '-i', 'color=size=256x256:rate=1',
+                '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-'
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        )
+        return result.returncode == 0
+    except Exception:
+        return False
+
+
+def _resolve_encoder(encoder: str) -> str:
+    if encoder != "auto":
+        return encoder
+    if _encoder_usable("h264_nvenc"):
+        return "h264_nvenc"
+    if sys.platform == 'darwin' and _encoder_usable("h264_videotoolbox"):
+        return "h264_videotoolbox"
+    return "libx264"
+
+
+@lru_cache(maxsize=1)
+def _detect_fourcc() -> Tuple[str, int]:
+    fd, test_path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        for codec_name, codec_fourcc in FOURCC_OPTIONS:
+            try:
+                test_writer = cv2.VideoWriter(test_path, codec_fourcc, 20, (640, 480))
+                opened = test_writer.isOpened()
+                test_writer.release()
+                if opened:
+                    return codec_name, codec_fourcc
+            except Exception:
+                continue
+    finally:
+        if os.path.exists(test_path):
+            os.remove(test_path)
+    return FOURCC_OPTIONS[-1]
+
+
+def _log_ffmpeg_stderr(process, name: str) -> None:
+    try:
+        for line in process.stderr:
+            text = line.decode(errors="ignore").rstrip()
+            if text:
+                log.warning("FFmpeg [%s]: %s", name, text)
+    except (OSError, ValueError):
+        pass
+
+
+def _write_all(fd: int, bufs: List[bytearray]) -> None:
+    if len(bufs) > 1 and hasattr(os, "writev"):
+        total = sum(len(b) for b in bufs)
+        written = os.writev(fd, bufs)
+        if written == total:
+            return
+        for buf in bufs:
+            if written >= len(buf):
+                written -= len(buf)
+                continue
+            _write_all(fd, [memoryview(buf)[written:]])
+            written = 0
+        return
+
+    for buf in bufs:
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+class _PipeWriter:
+
+    def __init__(self, process, label: str, frame_size: int,
+                 queue_size: int = PIPE_QUEUE_SIZE, realtime: bool = True):
+        self.process = process
+        self.label = label
+        self.realtime = realtime
+        self._fd = process.stdin.fileno()
+        self.broken = False
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._free: queue.Queue = queue.Queue()
+        for _ in range(queue_size + 1):
+            self._free.put(bytearray(frame_size))
+        self._thread = threading.Thread(
+            target=self._drain, name=f"ffmpeg-{label}", daemon=True
+        )
+        self._thread.start()
+
+    def acquire(self, size: int) -> bytearray | None:
+        # En tiempo real se descarta el frame si el encoder va atrasado;
+        # en análisis de fichero se espera para no perder frames.
+        try:
+            if self.realtime:
+                buf = self._free.get_nowait()
+            else:
+                buf = self._free.get(timeout=PIPE_BLOCK_TIMEOUT)
+        except queue.Empty:
+            return None
+        if len(buf) != size:
+            buf = bytearray(size)
+        return buf
+
+    def submit(self, buf: bytearray) -> bool:
+        try:
+            if self.realtime:
+                self._queue.put_nowait(buf)
+            else:
+                self._queue.put(buf, timeout=PIPE_BLOCK_TIMEOUT)
+        except queue.Full:
+            self._free.put(buf)
+            return False
+        return True
+
+    def count_dropped(self, frames: int = 1) -> None:
+        # Se descarta tanto desde el hilo que produce frames como desde _drain.
+        with self._dropped_lock:
+            self.dropped += frames
+
+    def _drain(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < PIPE_WRITEV_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                stopping = True
+            if not batch:
+                continue
+
+            if self.broken:
+                self.count_dropped(len(batch))
+            else:
+                try:
+                    _write_all(self._fd, batch)
+                except (BrokenPipeError, OSError, ValueError) as e:
+                    log.error(f"Error escribiendo frame {self.label.upper()} a FFmpeg: {e}; se descartan los frames restantes")
+                    self.broken = True
+                    self.count_dropped(len(batch))
+            for buf in batch:
+                self._free.put(buf)
+
+    def stop(self, timeout: float = 10) -> None:
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            log.error("FFmpeg %s: el hilo de escritura no responde; se abandona", self.label.upper())
+            self.broken = True
+            return
+        self._thread.join(timeout=timeout)
+
 
 class SessionManager:
 
@@ -29,11 +232,23 @@ class SessionManager:
         generate_legacy: bool = True,
         use_ffmpeg: bool = True,
         video_bitrate: str = "8000k",
+        quality_mode: str = "crf",
+        overlay_sidecar: bool = False,
+        preset: str = "veryfast",
+        tune: str | None = "zerolatency",
+        encoder: str = "auto",
+        realtime: bool = True,
     ):
+        if quality_mode not in QUALITY_MODES:
+            raise ValueError(f"Modo de calidad inválido: {quality_mode}. Use 'crf', 'cbr' o 'lossless'")
+        if encoder not in ENCODERS:
+            raise ValueError(f"Encoder inválido: {encoder}. Use uno de: {', '.join(ENCODERS)}")
+
         if output_dir is None:
             output_dir = str(get_exports_dir() / "videos")
         self.output_dir = output_dir
-        os.makedirs(self.output_dir, exist_ok=True)
+        self._output_path = Path(output_dir)
+        self._output_path.mkdir(parents=True, exist_ok=True)
         log.info(f"Directorio de salida: {self.output_dir}")
         
         self.video_writer_raw: cv2.VideoWriter | None = None
@@ -60,44 +275,120 @@ class SessionManager:
         self.sampling_rate = sampling_rate
         self.last_sample_time = 0.0
 
-        self.metric_records: Dict[str, List[float]] = {}
+        self._metric_keys: List[str] | None = None
+        self._metric_getter = None
+        self._metric_values: np.ndarray | None = None
+        self._metric_rows = 0
+        self._key_is_metric: Dict[str, bool] = {}
+        self._key_unit: Dict[str, str] = {}
 
         self._frames_written = 0
         self._frames_recorded_to_db = 0
+        self._pending_rows: List[dict] = []
+        self._last_flush = 0.0
+        self._last_flush_log = 0.0
+
+        self._pipe_writers: Dict[str, _PipeWriter] = {}
+        self.disk_space_low = False
+        self.video_stopped_low_disk = False
+        self._low_disk_closer: threading.Thread | None = None
+        self._disk_monitor_stop = threading.Event()
+        self._disk_monitor: threading.Thread | None = None
         
         self.sequence_counter = 0
         
-        self.generate_raw = generate_raw
+        self.overlay_sidecar = overlay_sidecar
+        self.generate_raw = generate_raw or overlay_sidecar
         self.generate_mediapipe = generate_mediapipe
         self.generate_legacy = generate_legacy
+        self.overlay_writer: OverlaySidecarWriter | None = None
+        self.overlay_path: str | None = None
         
         self.use_ffmpeg = use_ffmpeg
         self.video_bitrate = video_bitrate
+        self.quality_mode = quality_mode
+        self.preset = preset
+        self.tune = tune
+        self.encoder = encoder
+        self.realtime = realtime
+        self._video_codec: str | None = None
 
         log.info(
             "SessionManager created base_name=%s, patient=%s, exercise=%s, sampling_rate=%s, "
-            "versions=(raw=%s, mediapipe=%s, legacy=%s), use_ffmpeg=%s, bitrate=%s",
+            "versions=(raw=%s, mediapipe=%s, legacy=%s), use_ffmpeg=%s, bitrate=%s, quality=%s, "
+            "preset=%s, tune=%s, encoder=%s, overlay_sidecar=%s",
             self.base_name, self.patient_id, self.exercise_id, self.sampling_rate,
             self.generate_raw, self.generate_mediapipe, self.generate_legacy,
-            self.use_ffmpeg, self.video_bitrate
+            self.use_ffmpeg, self.video_bitrate, self.quality_mode,
+            self.preset, self.tune, self.encoder, self.overlay_sidecar
         )
 
+    def _preset_args(self, fps: int) -> List[str]:
+        preset = 'ultrafast' if self.quality_mode == "lossless" else self.preset
+        args = ['-preset', preset]
+        if self.tune:
+            args += ['-tune', self.tune]
+        args += ['-x264-params', f'keyint={2 * fps}:scenecut=0']
+        return args
+
+    def _rate_control_args(self) -> List[str]:
+        if self.quality_mode == "lossless":
+            return ['-qp', '0']
+        if self.quality_mode == "cbr":
+            return [
+                '-b:v', self.video_bitrate,
+                '-minrate', self.video_bitrate,
+                '-maxrate', self.video_bitrate,
+                '-bufsize', self.video_bitrate,
+            ]
+        return [
+            '-crf', '18',
+            '-maxrate', self.video_bitrate,
+            '-bufsize', _scale_bitrate(self.video_bitrate, 2),
+        ]
+
+    def _encoder_args(self, fps: int) -> List[str]:
+        if self._video_codec is None:
+            self._video_codec = _resolve_encoder(self.encoder)
+            log.info("Encoder de vídeo seleccionado: %s", self._video_codec)
+
+        codec = self._video_codec
+        if codec.endswith("_nvenc"):
+            return [
+                '-vcodec', codec,
+                '-preset', 'p4',
+                '-tune', 'll',
+                '-rc', 'vbr',
+                '-cq', '20',
+                '-b:v', self.video_bitrate,
+            ]
+        if codec == "h264_videotoolbox":
+            return [
+                '-vcodec', codec,
+                '-q:v', '55',
+                '-realtime', '1',
+            ]
+        return [
+            '-vcodec', 'libx264',
+            *self._preset_args(fps),
+            *self._rate_control_args(),
+        ]
+
     def _create_ffmpeg_writer(self, output_path: str, width: int, height: int, fps: int):
         try:
             cmd = [
                 'ffmpeg',
                 '-y',
+                '-hide_banner',
+                '-loglevel', 'error',
                 '-f', 'rawvideo',
                 '-vcodec', 'rawvideo',
                 '-s', f'{width}x{height}',
-                '-pix_fmt', 'bgr24',
+                '-pix_fmt', 'yuv420p',
                 '-r', str(fps),
                 '-i', '-',
                 '-an',
-                '-vcodec', 'libx264',
-                '-preset', 'medium',
-                '-crf', '18',
-                '-b:v', self.video_bitrate,
+                *self._encoder_args(fps),
                 '-pix_fmt', 'yuv420p',
                 '-movflags', '+faststart',
                 output_path
@@ -105,12 +396,19 @@ class SessionManager:
             
             process = subprocess.Popen(
                 cmd,
+                bufsize=PIPE_BUFFER_SIZE,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE
             )
+            threading.Thread(
+                target=_log_ffmpeg_stderr,
+                args=(process, os.path.basename(output_path)),
+                name="ffmpeg-stderr",
+                daemon=True
+            ).start()
             
-            log.info(f"FFmpeg writer creado: {output_path} ({width}x{height} @ {fps}fps, bitrate={self.video_bitrate}, CRF=18)")
+            log.info(f"FFmpeg writer creado: {output_path} ({width}x{height} @ {fps}fps, codec={self._video_codec}, bitrate={self.video_bitrate}, quality={self.quality_mode})")
             return process
             
         except FileNotFoundError:
@@ -123,79 +421,65 @@ class SessionManager:
     def start_session(self, width: int, height: int, fps: float | int) -> int:
         self.frame_size = (width, height)
         self.fps = int(round(fps)) if fps else 20
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
         self.sequence_counter = 0
+        self._last_flush = self._last_flush_log = time.monotonic()
 
-        has_space, available_mb = check_disk_space(100)
+        has_space, available_mb = check_disk_space(MIN_FREE_DISK_MB)
         if not has_space:
             raise RuntimeError(f"Espacio insuficiente en disco. Disponible: {available_mb}MB")
         log.info(f"Espacio disponible en disco: {available_mb}MB")
+        self._start_disk_monitor()
         
         ts = timestamp()
+        name_template = f"{self.base_name}_{{kind}}_{width}x{height}_{self.fps}fps_{ts}"
+        output_path = self._output_path
         
         log.info(f"Iniciando sesión con resolución {width}x{height} @ {self.fps}fps")
         
         if self.use_ffmpeg:
-            log.info("Usando FFmpeg para máxima calidad (CRF=18, bitrate=%s)", self.video_bitrate)
+            log.info("Usando FFmpeg (quality=%s, bitrate=%s)", self.quality_mode, self.video_bitrate)
             
+            streams = []
             if self.generate_raw:
-                self.video_path_raw = os.path.join(
-                    self.output_dir, f"{self.base_name}_raw_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
-                self.ffmpeg_raw = self._create_ffmpeg_writer(self.video_path_raw, width, height, self.fps)
-                if self.ffmpeg_raw:
-                    log.info("FFmpeg RAW writer creado: %s", self.video_path_raw)
-            
-            if self.generate_mediapipe:
-                self.video_path_mediapipe = os.path.join(
-                    self.output_dir, f"{self.base_name}_mediapipe_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
-                self.ffmpeg_mediapipe = self._create_ffmpeg_writer(self.video_path_mediapipe, width, height, self.fps)
-                if self.ffmpeg_mediapipe:
-                    log.info("FFmpeg MEDIAPIPE writer creado: %s", self.video_path_mediapipe)
-            
-            if self.generate_legacy:
-                self.video_path_legacy = os.path.join(
-                    self.output_dir, f"{self.base_name}_legacy_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
-                self.ffmpeg_legacy = self._create_ffmpeg_writer(self.video_path_legacy, width, height, self.fps)
-                if self.ffmpeg_legacy:
-                    log.info("FFmpeg LEGACY writer creado: %s", self.video_path_legacy)
-        
+                self.video_path_raw = str(output_path / (name_template.format(kind="raw") + ".mp4"))
+                streams.append(("raw", self.video_path_raw))
+            if self.generate_mediapipe and not self.overlay_sidecar:
+                self.video_path_mediapipe = str(output_path / (name_template.format(kind="mediapipe") + ".mp4"))
+                streams.append(("mediapipe", self.video_path_mediapipe))
+            if self.generate_legacy and not self.overlay_sidecar:
+                self.video_path_legacy = str(output_path / (name_template.format(kind="legacy") + ".mp4"))
+                streams.append(("legacy", self.video_path_legacy))
+
+            if streams:
+                if self._video_codec is None:
+                    self._video_codec = _resolve_encoder(self.encoder)
+                    log.info("Encoder de vídeo seleccionado: %s", self._video_codec)
+                with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+                    processes = list(executor.map(
+                        lambda stream: self._create_ffmpeg_writer(stream[1], width, height, self.fps),
+                        streams
+                    ))
+
+                for (label, path), process in zip(streams, processes):
+                    setattr(self, f"ffmpeg_{label}", process)
+                    if process:
+                        self._pipe_writers[label] = _PipeWriter(
+                            process, label, width * height * 3 // 2, realtime=self.realtime
+                        )
+                        log.info("FFmpeg %s writer creado: %s", label.upper(), path)
+
         else:
             log.info("Usando OpenCV VideoWriter (calidad limitada)")
             
-            fourcc_options = [
-                ('H264', cv2.VideoWriter_fourcc(*'H264')),
-                ('X264', cv2.VideoWriter_fourcc(*'X264')),
-                ('avc1', cv2.VideoWriter_fourcc(*'avc1')),
-                ('mp4v', cv2.VideoWriter_fourcc(*'mp4v')),
-            ]
-            
-            fourcc = None
-            for codec_name, codec_fourcc in fourcc_options:
-                try:
-                    test_writer = cv2.VideoWriter(
-                        'test.mp4', codec_fourcc, self.fps, self.frame_size
-                    )
-                    if test_writer.isOpened():
-                        fourcc = codec_fourcc
-                        log.info(f"Usando codec: {codec_name}")
-                        test_writer.release()
-                        if os.path.exists('test.mp4'):
-                            os.remove('test.mp4')
-                        break
-                except Exception:
-                    continue
-            
-            if fourcc is None:
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            codec_name, fourcc = _detect_fourcc()
+            if codec_name == 'mp4v':
                 log.warning("Usando codec mp4v (baja calidad)")
+            else:
+                log.info(f"Usando codec: {codec_name}")
             
             if self.generate_raw:
-                self.video_path_raw = os.path.join(
-                    self.output_dir, f"{self.base_name}_raw_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
+                self.video_path_raw = str(output_path / (name_template.format(kind="raw") + ".mp4"))
                 self.video_writer_raw = cv2.VideoWriter(
                     self.video_path_raw, fourcc, self.fps, self.frame_size
                 )
@@ -204,10 +488,8 @@ class SessionManager:
                 else:
                     log.info("OpenCV RAW writer creado: %s", self.video_path_raw)
             
-            if self.generate_mediapipe:
-                self.video_path_mediapipe = os.path.join(
-                    self.output_dir, f"{self.base_name}_mediapipe_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
+            if self.generate_mediapipe and not self.overlay_sidecar:
+                self.video_path_mediapipe = str(output_path / (name_template.format(kind="mediapipe") + ".mp4"))
                 self.video_writer_mediapipe = cv2.VideoWriter(
                     self.video_path_mediapipe, fourcc, self.fps, self.frame_size
                 )
@@ -216,10 +498,8 @@ class SessionManager:
                 else:
                     log.info("OpenCV MEDIAPIPE writer creado: %s", self.video_path_mediapipe)
             
-            if self.generate_legacy:
-                self.video_path_legacy = os.path.join(
-                    self.output_dir, f"{self.base_name}_legacy_{width}x{height}_{self.fps}fps_{ts}.mp4"
-                )
+            if self.generate_legacy and not self.overlay_sidecar:
+                self.video_path_legacy = str(output_path / (name_template.format(kind="legacy") + ".mp4"))
                 self.video_writer_legacy = cv2.VideoWriter(
                     self.video_path_legacy, fourcc, self.fps, self.frame_size
                 )
@@ -228,6 +508,11 @@ class SessionManager:
                 else:
                     log.info("OpenCV LEGACY writer creado: %s", self.video_path_legacy)
 
+        if self.overlay_sidecar:
+            self.overlay_path = str(output_path / (name_template.format(kind="overlay") + ".jsonl.gz"))
+            self.overlay_writer = OverlaySidecarWriter(self.overlay_path)
+            log.info("Overlay sidecar creado: %s", self.overlay_path)
+
         log.info(
             "start_session: size=%s, fps=%s, patient=%s, exercise=%s",
             self.frame_size, self.fps, self.patient_id, self.exercise_id
@@ -239,12 +524,32 @@ class SessionManager:
             video_path_raw=self.video_path_raw,
             video_path_mediapipe=self.video_path_mediapipe,
             video_path_legacy=self.video_path_legacy,
-            notes=self.notes
+            notes=self.notes,
+            overlay_path=self.overlay_path
         )
         
+        if self.sampling_rate <= 0:
+            self.should_record_frame = lambda: True
+
         log.info("start_session OK: session_id=%s", self.session_id)
         return int(self.session_id)
 
+    def _start_disk_monitor(self) -> None:
+        self.disk_space_low = False
+        self.video_stopped_low_disk = False
+        self._disk_monitor_stop.clear()
+        self._disk_monitor = threading.Thread(
+            target=self._monitor_disk_space, name="disk-monitor", daemon=True
+        )
+        self._disk_monitor.start()
+
+    def _monitor_disk_space(self) -> None:
+        while not self._disk_monitor_stop.wait(DISK_CHECK_SECONDS):
+            has_space, available_mb = check_disk_space(MIN_FREE_DISK_MB)
+            if not has_space and not self.disk_space_low:
+                log.error("Espacio en disco agotándose durante la grabación: %sMB disponibles", available_mb)
+            self.disk_space_low = not has_space
+
     def should_record_frame(self) -> bool:
         if self.sampling_rate <= 0:
             return True
@@ -265,56 +570,194 @@ class SessionManager:
             return
 
         data = {
-            "time_seconds": elapsed_time,
+            "time_seconds": round(elapsed_time, 2),
             "frame": frame_index,
             **joints
         }
+        self._pending_rows.append(data)
 
+        if (len(self._pending_rows) >= DB_FLUSH_ROWS
+                or time.monotonic() - self._last_flush >= DB_FLUSH_SECONDS):
+            self._flush_movement_data()
+
+        self._accumulate_metrics(joints)
+
+    def _flush_movement_data(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending_rows or self.session_id is None:
+            return
+        rows, self._pending_rows = self._pending_rows, []
         try:
-            crud.add_movement_data(self.session_id, data)
-            self._frames_recorded_to_db += 1
+            self._frames_recorded_to_db += crud.add_movement_data_many(self.session_id, rows)
         except Exception:
-            log.exception("add_movement_data FAILED")
+            log.exception("add_movement_data_many FAILED (%s filas)", len(rows))
+            return
 
-        self._accumulate_metrics(joints)
+        if (self._last_flush - self._last_flush_log >= DB_LOG_SECONDS
+                and log.isEnabledFor(logging.DEBUG)):
+            self._last_flush_log = self._last_flush
+            log.debug("movement_data: %s filas guardadas (sid=%s)",
+                      self._frames_recorded_to_db, self.session_id)
+
+    def _is_metric_key(self, key: str) -> bool:
+        is_metric = self._key_is_metric.get(key)
+        if is_metric is None:
+            is_metric = "angle" in key or "symmetry" in key
+            self._key_is_metric[key] = is_metric
+        return is_metric
+
+    def _metric_unit(self, metric_name: str) -> str:
+        unit = self._key_unit.get(metric_name)
+        if unit is None:
+            if "symmetry" in metric_name and "_y" in metric_name:
+                unit = "pixels"
+            else:
+                unit = "degrees"
+            self._key_unit[metric_name] = unit
+        return unit
 
     def _accumulate_metrics(self, joints: dict) -> None:
-        for key, val in joints.items():
-            if ("angle" in key or "symmetry" in key) and val is not None:
+        if self._metric_keys is None:
+            self._metric_keys = [key for key in joints if self._is_metric_key(key)]
+            self._metric_getter = itemgetter(*self._metric_keys) if self._metric_keys else None
+            self._metric_values = np.empty((1024, len(self._metric_keys)), dtype=np.float64)
+            self._metric_rows = 0
+
+        if self._metric_getter is None:
+            return
+
+        if self._metric_rows == len(self._metric_values):
+            self._metric_values = np.concatenate(
+                (self._metric_values, np.empty_like(self._metric_values))
+            )
+
+        try:
+            values = self._metric_getter(joints)
+        except KeyError:
+            values = tuple(joints.get(key) for key in self._metric_keys)
+        self._metric_values[self._metric_rows] = np.array(values, dtype=np.float64)
+        self._metric_rows += 1
+
+    def _pipe(self, frame, label: str, converted: Dict[int, bytearray]) -> bool:
+        writer = self._pipe_writers.get(label)
+        if writer is None or frame is None:
+            return False
+        if writer.broken:
+            writer.count_dropped()
+            return False
+        if writer.process.poll() is not None:
+            log.error("FFmpeg %s terminó inesperadamente (code=%s); se descartan los frames restantes",
+                      label.upper(), writer.process.returncode)
+            writer.broken = True
+            writer.count_dropped()
+            return False
+
+        h, w = frame.shape[:2]
+        buf = writer.acquire(w * h * 3 // 2)
+        if buf is None:
+            writer.count_dropped()
+            return False
+
+        src = converted.get(id(frame))
+        if src is None:
+            bgr_to_i420(frame, buf)
+            converted[id(frame)] = buf
+        else:
+            buf[:] = src
+        if not writer.submit(buf):
+            writer.count_dropped()
+            return False
+        return True
+
+    def _detach_video_outputs(self) -> Tuple[List[_PipeWriter], Dict[str, object], Dict[str, object]]:
+        # Se desenganchan en el hilo que escribe frames para que nadie más
+        # los use; el cierre (lento) puede hacerse después en otro hilo.
+        pipe_writers = list(self._pipe_writers.values())
+        processes = {
+            "raw": self.ffmpeg_raw,
+            "mediapipe": self.ffmpeg_mediapipe,
+            "legacy": self.ffmpeg_legacy,
+        }
+        cv_writers = {
+            "raw": self.video_writer_raw,
+            "mediapipe": self.video_writer_mediapipe,
+            "legacy": self.video_writer_legacy,
+        }
+        self._pipe_writers = {}
+        self.ffmpeg_raw = self.ffmpeg_mediapipe = self.ffmpeg_legacy = None
+        self.video_writer_raw = self.video_writer_mediapipe = self.video_writer_legacy = None
+        return pipe_writers, processes, cv_writers
+
+    @staticmethod
+    def _close_video_outputs(pipe_writers, processes, cv_writers) -> None:
+        for writer in pipe_writers:
+            writer.stop()
+            if writer.dropped:
+                log.warning("close_session: %s frames %s descartados por pipe FFmpeg",
+                            writer.dropped, writer.label.upper())
+
+        for label, process in processes.items():
+            if process:
+                try:
+                    process.stdin.close()
+                    process.wait(timeout=10)
+                    log.info("FFmpeg %s cerrado", label.upper())
+                except Exception as e:
+                    log.exception(f"Error cerrando FFmpeg {label.upper()}: {e}")
+
+        for label, video_writer in cv_writers.items():
+            if video_writer:
                 try:
-                    fval = float(val)
-                    if not math.isnan(fval):
-                        self.metric_records.setdefault(key, []).append(fval)
-                except (TypeError, ValueError):
-                    pass
+                    video_writer.release()
+                    log.info("VideoWriter %s cerrado", label.upper())
+                except Exception:
+                    log.exception("close_session: video_writer_%s.release() FAILED", label)
+
+    def _stop_video_low_disk(self) -> None:
+        log.error("Grabación de vídeo detenida por falta de espacio en disco (frame %s); "
+                  "se siguen registrando los datos articulares", self._frames_written)
+        self.video_stopped_low_disk = True
+        outputs = self._detach_video_outputs()
+        overlay_writer = self.overlay_writer
+
+        def close_outputs():
+            self._close_video_outputs(*outputs)
+            if overlay_writer:
+                try:
+                    overlay_writer.close()
+                except Exception:
+                    log.exception("_stop_video_low_disk: overlay_writer.close() FAILED")
+
+        # Cerrar FFmpeg puede tardar decenas de segundos con el disco lleno:
+        # se hace fuera del hilo de frames (recv() en directo).
+        self._low_disk_closer = threading.Thread(
+            target=close_outputs, name="low-disk-close", daemon=True
+        )
+        self._low_disk_closer.start()
 
     def write_video_frames(
         self, 
         frame_raw=None, 
         frame_mediapipe=None, 
         frame_legacy=None
-    ) -> None:
+    ) -> bool:
+        # True si el frame RAW llegó al encoder: el sidecar solo debe
+        # registrar esos frames para seguir alineado con el vídeo RAW.
+        if self.disk_space_low and not self.video_stopped_low_disk:
+            self._stop_video_low_disk()
+        if self.video_stopped_low_disk:
+            self.sequence_counter += 1
+            return False
+
         if self.use_ffmpeg:
-            if self.ffmpeg_raw and frame_raw is not None:
-                try:
-                    self.ffmpeg_raw.stdin.write(frame_raw.tobytes())
-                except Exception as e:
-                    log.error(f"Error escribiendo frame RAW a FFmpeg: {e}")
-            
-            if self.ffmpeg_mediapipe and frame_mediapipe is not None:
-                try:
-                    self.ffmpeg_mediapipe.stdin.write(frame_mediapipe.tobytes())
-                except Exception as e:
-                    log.error(f"Error escribiendo frame MEDIAPIPE a FFmpeg: {e}")
-            
-            if self.ffmpeg_legacy and frame_legacy is not None:
-                try:
-                    self.ffmpeg_legacy.stdin.write(frame_legacy.tobytes())
-                except Exception as e:
-                    log.error(f"Error escribiendo frame LEGACY a FFmpeg: {e}")
-        
+            converted: Dict[int, bytearray] = {}
+            raw_written = self._pipe(frame_raw, "raw", converted)
+            self._pipe(frame_mediapipe, "mediapipe", converted)
+            self._pipe(frame_legacy, "legacy", converted)
+
         else:
-            if self.video_writer_raw and frame_raw is not None:
+            raw_written = self.video_writer_raw is not None and frame_raw is not None
+            if raw_written:
                 self.video_writer_raw.write(frame_raw)
             
             if self.video_writer_mediapipe and frame_mediapipe is not None:
@@ -325,6 +768,17 @@ class SessionManager:
         
         self._frames_written += 1
         self.sequence_counter += 1
+        return raw_written
+
+    def record_overlay(
+        self, frame_index: int, sequence: int, landmarks: dict | None, angles: dict | None
+    ) -> None:
+        if self.overlay_writer is None or self.video_stopped_low_disk:
+            return
+        try:
+            self.overlay_writer.write(frame_index, sequence, landmarks, angles)
+        except Exception as e:
+            log.error(f"Error escribiendo overlay sidecar: {e}")
 
     def get_sequence_counter(self) -> int:
         return self.sequence_counter
@@ -336,58 +790,36 @@ class SessionManager:
             self.sampling_rate, self.sequence_counter
         )
 
-        if self.use_ffmpeg:
-            if self.ffmpeg_raw:
-                try:
-                    self.ffmpeg_raw.stdin.close()
-                    self.ffmpeg_raw.wait(timeout=10)
-                    log.info("FFmpeg RAW cerrado")
-                except Exception as e:
-                    log.exception(f"Error cerrando FFmpeg RAW: {e}")
-            
-            if self.ffmpeg_mediapipe:
-                try:
-                    self.ffmpeg_mediapipe.stdin.close()
-                    self.ffmpeg_mediapipe.wait(timeout=10)
-                    log.info("FFmpeg MEDIAPIPE cerrado")
-                except Exception as e:
-                    log.exception(f"Error cerrando FFmpeg MEDIAPIPE: {e}")
-            
-            if self.ffmpeg_legacy:
-                try:
-                    self.ffmpeg_legacy.stdin.close()
-                    self.ffmpeg_legacy.wait(timeout=10)
-                    log.info("FFmpeg LEGACY cerrado")
-                except Exception as e:
-                    log.exception(f"Error cerrando FFmpeg LEGACY: {e}")
-        
-        else:
-            if self.video_writer_raw:
-                try:
-                    self.video_writer_raw.release()
-                    log.info("VideoWriter RAW cerrado")
-                except Exception:
-                    log.exception("close_session: video_writer_raw.release() FAILED")
-            
-            if self.video_writer_mediapipe:
-                try:
-                    self.video_writer_mediapipe.release()
-                    log.info("VideoWriter MEDIAPIPE cerrado")
-                except Exception:
-                    log.exception("close_session: video_writer_mediapipe.release() FAILED")
-            
-            if self.video_writer_legacy:
-                try:
-                    self.video_writer_legacy.release()
-                    log.info("VideoWriter LEGACY cerrado")
-                except Exception:
-                    log.exception("close_session: video_writer_legacy.release() FAILED")
+        self._disk_monitor_stop.set()
+
+        if self._low_disk_closer is not None:
+            self._low_disk_closer.join()
+            self._low_disk_closer = None
+        self._close_video_outputs(*self._detach_video_outputs())
+
+        if self.overlay_writer:
+            try:
+                self.overlay_writer.close()
+                log.info("Overlay sidecar cerrado: %s registros", self.overlay_writer.records_written)
+            except Exception:
+                log.exception("close_session: overlay_writer.close() FAILED")
+
+        self._flush_movement_data()
+        if self._frames_recorded_to_db:
+            try:
+                crud.refresh_movement_statistics()
+            except Exception:
+                log.exception("close_session: refresh_movement_statistics() FAILED")
+            try:
+                crud.checkpoint_wal()
+            except Exception:
+                log.exception("close_session: checkpoint_wal() FAILED")
 
         if not self.session_id:
             log.warning("close_session: session_id is None (no se guardarán métricas).")
             return
 
-        if not self.metric_records:
+        if not self._metric_rows or not self._metric_keys:
             log.info("close_session: sin registros de métricas para sid=%s", self.session_id)
             log.info(
                 "close_session DONE: sid=%s, metrics_rows_saved=0, frames_written=%s",
@@ -395,39 +827,28 @@ class SessionManager:
             )
             return
 
-        saved = 0
-        for metric_name, values in self.metric_records.items():
-            if not values:
-                continue
+        values = self._metric_values[:self._metric_rows]
+        has_values = ~np.isnan(values).all(axis=0)
+        values = values[:, has_values]
+        metric_names = [name for name, ok in zip(self._metric_keys, has_values) if ok]
 
-            clean_vals: List[float] = []
-            for v in values:
-                try:
-                    fv = float(v)
-                    if not math.isnan(fv):
-                        clean_vals.append(fv)
-                except (TypeError, ValueError):
-                    continue
+        maxima = np.nanmax(values, axis=0) if metric_names else []
+        minima = np.nanmin(values, axis=0) if metric_names else []
 
-            if not clean_vals:
-                continue
-
-            mx = max(clean_vals)
-            mn = min(clean_vals)
-            rg = mx - mn
-
-            if "symmetry" in metric_name and "_y" in metric_name:
-                unit = "pixels"
-            else:
-                unit = "degrees"
+        rows: List[Tuple[str, float, str]] = []
+        for metric_name, mx, mn in zip(metric_names, maxima, minima):
+            mx = float(mx)
+            mn = float(mn)
+            unit = self._metric_unit(metric_name)
+            rows.append((f"{metric_name}_max", mx, unit))
+            rows.append((f"{metric_name}_min", mn, unit))
+            rows.append((f"{metric_name}_range", mx - mn, unit))
 
-            try:
-                crud.add_metric(self.session_id, f"{metric_name}_max", mx, unit=unit)
-                crud.add_metric(self.session_id, f"{metric_name}_min", mn, unit=unit)
-                crud.add_metric(self.session_id, f"{metric_name}_range", rg, unit=unit)
-                saved += 3
-            except Exception:
-                log.exception("FAILED saving metrics for '%s'", metric_name)
+        saved = 0
+        try:
+            saved = crud.add_metrics_bulk(self.session_id, rows)
+        except Exception:
+            log.exception("FAILED saving %s metrics for sid=%s", len(rows), self.session_id)
 
         log.info(
             "close_session DONE: sid=%s, metrics_rows=%s, frames_written=%s, frames_in_db=%s, "
@@ -438,8 +859,11 @@ class SessionManager:
 
     def elapsed_time(self) -> float:
         if self.start_time:
-            return round(time.time() - self.start_time, 2)
+            return time.monotonic() - self.start_time
         return 0.0
     
     def get_video_paths(self) -> Tuple[str | None, str | None, str | None]:
-        return (self.video_path_raw, self.video_path_mediapipe, self.video_path_legacy)
\ No newline at end of file
+        return (self.video_path_raw, self.video_path_mediapipe, self.video_path_legacy)
+
+    def get_overlay_path(self) -> str | None:
+        return self.overlay_path
\ No newline at end of file
@@ -1,6 +1,8 @@
+import math
 import os
 import sys
-from datetime import datetime
+import time
+import warnings
 from pathlib import Path
 
 from core.path_manager import (
@@ -10,14 +12,19 @@ from core.path_manager import (
     check_disk_space as path_manager_check_disk_space
 )
 
+_TS_FMT = "%Y%m%d_%H%M%S"
+_base_directory_warned = False
+
 
 def get_base_directory():
-    import warnings
-    warnings.warn(
-        "get_base_directory() está deprecado. Usa path_manager.get_app_root() en su lugar.",
-        DeprecationWarning,
-        stacklevel=2
-    )
+    global _base_directory_warned
+    if not _base_directory_warned:
+        _base_directory_warned = True
+        warnings.warn(
+            "get_base_directory() está deprecado. Usa path_manager.get_app_root() en su lugar.",
+            DeprecationWarning,
+            stacklevel=2
+        )
     return str(get_app_root())
 
 
@@ -32,15 +39,14 @@ def ensure_dir(path: str) -> str:
 
 
 def timestamp() -> str:
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+    return time.strftime(_TS_FMT)
 
 
 def safe_round(value, decimals=2):
     if value is None:
         return None
     try:
-        import math
-        if math.isnan(value) or math.isinf(value):
+        if not math.isfinite(value):
             return None
         return round(float(value), decimals)
     except (TypeError, ValueError):
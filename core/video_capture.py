@@ -1,35 +1,248 @@
+import sys
+import threading
+import queue
+
 import cv2
+import numpy as np
+
+FRAME_QUEUE_SIZE = 2
+WRITE_QUEUE_SIZE = 64
+WRITE_POOL_SIZE = 4
+
+
+def _capture_backend(source):
+    if not isinstance(source, int):
+        return cv2.CAP_FFMPEG
+    if sys.platform == "darwin":
+        return cv2.CAP_AVFOUNDATION
+    if sys.platform == "win32":
+        return cv2.CAP_DSHOW
+    return cv2.CAP_V4L2
+
+
+def _writer_candidates(output_path, fps, frame_size):
+    if sys.platform == "darwin":
+        yield "avc1/VideoToolbox", (
+            output_path, cv2.CAP_AVFOUNDATION, cv2.VideoWriter_fourcc(*"avc1"), fps, frame_size
+        )
+    registry = getattr(cv2, "videoio_registry", None)
+    if registry and cv2.CAP_GSTREAMER in registry.getWriterBackends():
+        # Entre comillas para que espacios o "!" en la ruta no rompan el pipeline.
+        location = str(output_path).replace("\\", "\\\\").replace('"', '\\"')
+        pipeline = (
+            "appsrc ! videoconvert ! x264enc tune=zerolatency bitrate=4000 "
+            f'speed-preset=veryfast ! mp4mux ! filesink location="{location}"'
+        )
+        yield "x264/GStreamer", (pipeline, cv2.CAP_GSTREAMER, 0, fps, frame_size, True)
+    yield "avc1", (output_path, cv2.VideoWriter_fourcc(*"avc1"), fps, frame_size)
+    yield "mp4v", (output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, frame_size)
+
+
+def _open_writer(output_path, fps, frame_size):
+    for name, args in _writer_candidates(output_path, fps, frame_size):
+        try:
+            writer = cv2.VideoWriter(*args)
+        except cv2.error:
+            continue
+        if writer.isOpened():
+            return name, writer
+        writer.release()
+    return None, None
+
 
 class VideoCaptureManager:
 
-    def __init__(self, source=0):
-        self.cap = cv2.VideoCapture(source, cv2.CAP_AVFOUNDATION)   
+    def __init__(self, source=0, target_fps=None, target_resolution=(1280, 720), resize_to=None):
+        self.source = source
+        self.cap = cv2.VideoCapture(source, _capture_backend(source))
+        if not self.cap.isOpened():
+            self.cap = cv2.VideoCapture(source)
         if not self.cap.isOpened():
             raise RuntimeError(f"No se pudo abrir la fuente de vídeo: {source}")
 
+        if isinstance(source, int):
+            try:
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                if target_resolution:
+                    self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, target_resolution[0])
+                    self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, target_resolution[1])
+            except cv2.error:
+                pass
+
         self.fps = round(self.cap.get(cv2.CAP_PROP_FPS)) or 30
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.resize_to = tuple(resize_to) if resize_to else None
+        self._decode_buf = None
+        if self.resize_to:
+            self.width, self.height = self.resize_to
+        else:
+            self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self.frame_size = (self.width, self.height)
+        self.sample_every = max(1, round(self.fps / target_fps)) if target_fps else 1
         print(f"[VideoCaptureManager] Fuente abierta: {source} ({self.width}x{self.height} @ {self.fps}fps)")
 
         self.video_writer = None
+        self._write_queue: queue.Queue | None = None
+        self._write_thread: threading.Thread | None = None
+        self._write_pool: queue.Queue = queue.Queue()
+        self._write_pool_ids: set = set()
+
+        self._frames: queue.Queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self._reader_stop = threading.Event()
+        self._reader_thread: threading.Thread | None = None
+        self._eof = False
+        self._free_frames: queue.Queue = queue.Queue()
+        self._ring_ids: set = set()
+        self._held = None
 
-    def read_frame(self):
-        return self.cap.read()
+    def start(self):
+        if self._reader_thread is not None:
+            return
+        self._reader_stop.clear()
+        for _ in range(FRAME_QUEUE_SIZE + 2):
+            buf = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            self._ring_ids.add(id(buf))
+            self._free_frames.put_nowait(buf)
+        self._reader_thread = threading.Thread(
+            target=self._reader, name="capture-reader", daemon=True
+        )
+        self._reader_thread.start()
+
+    def _reader(self):
+        live = isinstance(self.source, int)
+        while not self._reader_stop.is_set():
+            try:
+                buf = self._free_frames.get_nowait()
+            except queue.Empty:
+                buf = None
+            ret, frame = self._grab_frame(dst=buf)
+            if frame is not buf and buf is not None:
+                self._free_frames.put_nowait(buf)
+            item = frame if ret else None
+            if live:
+                try:
+                    self._frames.put_nowait(item)
+                except queue.Full:
+                    try:
+                        self._recycle(self._frames.get_nowait())
+                    except queue.Empty:
+                        pass
+                    self._frames.put_nowait(item)
+            else:
+                while not self._reader_stop.is_set():
+                    try:
+                        self._frames.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+            if item is None:
+                return
+
+    def _recycle(self, frame):
+        if frame is not None and id(frame) in self._ring_ids:
+            self._free_frames.put_nowait(frame)
+
+    def read_frame(self, sample_every=None):
+        """
+        Devuelve (ret, frame). Con el lector en hilo (start()), el frame
+        es un buffer reutilizado: solo es válido hasta la siguiente
+        llamada a read_frame; cópialo si necesitas conservarlo.
+        """
+        if self._reader_thread is None:
+            return self._grab_frame(sample_every)
+        if self._eof:
+            return False, None
+        frame = self._next_frame()
+        if frame is False:
+            return False, None
+        self._recycle(self._held)
+        self._held = frame
+        if frame is None:
+            self._eof = True
+            return False, None
+        return True, frame
+
+    def _next_frame(self):
+        # En directo se acota la espera; en ficheros se bloquea hasta el
+        # siguiente frame o el None de fin de fichero que envía el lector.
+        live = isinstance(self.source, int)
+        while True:
+            try:
+                return self._frames.get(timeout=1.0)
+            except queue.Empty:
+                if live:
+                    return False
+                if not self._reader_thread.is_alive():
+                    try:
+                        return self._frames.get_nowait()
+                    except queue.Empty:
+                        return False
+
+    def _grab_frame(self, sample_every=None, dst=None):
+        for _ in range((sample_every or self.sample_every) - 1):
+            if not self.cap.grab():
+                return False, None
+        if not self.cap.grab():
+            return False, None
+        if self.resize_to is None:
+            return self.cap.retrieve(dst)
+
+        ret, decoded = self.cap.retrieve(self._decode_buf)
+        if not ret:
+            return False, None
+        self._decode_buf = decoded
+        return True, cv2.resize(decoded, self.resize_to, dst=dst, interpolation=cv2.INTER_AREA)
 
     def create_writer(self, output_path):
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        self.video_writer = cv2.VideoWriter(output_path, fourcc, self.fps, self.frame_size)
-        print(f"[VideoCaptureManager] Grabador creado en {output_path}")
+        codec, self.video_writer = _open_writer(output_path, self.fps, self.frame_size)
+        if self.video_writer is None:
+            raise RuntimeError(f"No se pudo crear el grabador de vídeo: {output_path}")
+        self._write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._write_thread = threading.Thread(
+            target=self._write_loop, name="capture-writer", daemon=True
+        )
+        self._write_thread.start()
+        print(f"[VideoCaptureManager] Grabador creado en {output_path} ({codec})")
 
-    def write_frame(self, frame):
-        if self.video_writer:
+    def _write_loop(self):
+        while True:
+            frame = self._write_queue.get()
+            if frame is None:
+                return
             self.video_writer.write(frame)
+            if id(frame) in self._write_pool_ids:
+                self._write_pool.put_nowait(frame)
+
+    def _pooled_copy(self, frame):
+        try:
+            buf = self._write_pool.get_nowait()
+        except queue.Empty:
+            if len(self._write_pool_ids) < WRITE_POOL_SIZE:
+                buf = np.empty_like(frame)
+                self._write_pool_ids.add(id(buf))
+            else:
+                buf = self._write_pool.get()
+        np.copyto(buf, frame)
+        return buf
+
+    def write_frame(self, frame):
+        if self._write_queue is not None:
+            if id(frame) in self._ring_ids:
+                frame = self._pooled_copy(frame)
+            self._write_queue.put(frame)
 
     def release(self):
+        if self._reader_thread is not None:
+            self._reader_stop.set()
+            self._reader_thread.join(timeout=2.0)
+            self._reader_thread = None
         if self.cap:
             self.cap.release()
+        if self._write_thread is not None:
+            self._write_queue.put(None)
+            self._write_thread.join()
+            self._write_thread = None
+            self._write_queue = None
         if self.video_writer:
             self.video_writer.release()
         print("[VideoCaptureManager] Recursos liberados correctamente.")
\ No newline at end of file
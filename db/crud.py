@@ -1,6 +1,42 @@
-import sqlite3
-from typing import List, Dict, Any, Tuple
-from db.init_db import get_connection
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from db.init_db import get_connection, read_conn, writer, fetch_rows, row_type, bulk_load
+
+GENDERS = ("M", "F", "Other")
+_VALID_GENDERS = frozenset(GENDERS)
+
+MOVEMENT_COMMIT_ROWS = 10_000
+MOVEMENT_FETCH_ROWS = 10_000
+MOVEMENT_COORD_SCALE = 10
+
+_exercise_id_cache: Dict[str, int] = {}
+
+_SQL_INSERT_SESSION = """
+    INSERT INTO sessions (
+        patient_id, exercise_id, 
+        video_path_raw, video_path_mediapipe, video_path_legacy,
+        notes, overlay_path
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_INSERT_SESSION_LEGACY = """
+    INSERT INTO sessions (
+        patient_id, exercise_id, 
+        video_path_raw, video_path_mediapipe, video_path_legacy,
+        notes, overlay_path, video_path
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_INSERT_METRIC = """
+    INSERT INTO metrics (session_id, metric_name, metric_value, unit)
+    VALUES (?, ?, ?, ?)
+"""
 
 
 def create_patient(
@@ -10,30 +46,29 @@ def create_patient(
     gender: str | None = None,
     notes: str | None = None
 ) -> int:
-    if gender and gender not in ("M", "F", "Other"):
+    if gender and gender not in _VALID_GENDERS:
         raise ValueError(f"Género inválido: {gender}. Use 'M', 'F' o 'Other'")
     
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
-        
-        if dni:
-            cur.execute("SELECT id FROM patients WHERE dni = ?", (dni,))
-            if cur.fetchone():
-                raise ValueError(f"Ya existe un paciente con DNI: {dni}")
-        
         cur.execute(
             """
             INSERT INTO patients (name, dni, age, gender, notes)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(dni) DO NOTHING
+            RETURNING id
             """,
             (name, dni, age, gender, notes)
         )
-        conn.commit()
-        return cur.lastrowid
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError(f"Ya existe un paciente con DNI: {dni}")
+        
+        return row[0]
 
 
 def get_all_patients() -> List[Tuple]:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT id, name, dni, age, gender, notes, created_at FROM patients ORDER BY name"
@@ -42,7 +77,7 @@ def get_all_patients() -> List[Tuple]:
 
 
 def get_patient_by_id(patient_id: int) -> Tuple | None:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT id, name, dni, age, gender, notes, created_at FROM patients WHERE id = ?",
@@ -59,10 +94,10 @@ def update_patient(
     gender: str | None = None,
     notes: str | None = None
 ) -> bool:
-    if gender and gender not in ("M", "F", "Other"):
+    if gender and gender not in _VALID_GENDERS:
         raise ValueError(f"Género inválido: {gender}")
     
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         
         fields = []
@@ -91,54 +126,50 @@ def update_patient(
         query = f"UPDATE patients SET {', '.join(fields)} WHERE id = ?"
         
         cur.execute(query, values)
-        conn.commit()
         return cur.rowcount > 0
 
 
 def delete_patient(patient_id: int, cascade: bool = True) -> bool:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         
         if cascade:
-            cur.execute("SELECT id FROM sessions WHERE patient_id = ?", (patient_id,))
-            session_ids = [row[0] for row in cur.fetchall()]
-            
-            for sid in session_ids:
-                cur.execute("DELETE FROM movement_data WHERE session_id = ?", (sid,))
-                cur.execute("DELETE FROM metrics WHERE session_id = ?", (sid,))
-            
             cur.execute("DELETE FROM sessions WHERE patient_id = ?", (patient_id,))
         
         cur.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
-        conn.commit()
         return cur.rowcount > 0
 
 
 def create_exercise(name: str, description: str | None = None) -> int:
-    with get_connection() as conn:
+    cached = _exercise_id_cache.get(name)
+    if cached is not None:
+        return cached
+    
+    with writer() as conn:
         cur = conn.cursor()
         cur.execute(
-            "INSERT OR IGNORE INTO exercises (name, description) VALUES (?, ?)",
+            """
+            INSERT INTO exercises (name, description) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET name = excluded.name
+            RETURNING id
+            """,
             (name, description)
         )
-        if cur.lastrowid:
-            conn.commit()
-            return cur.lastrowid
-        
-        cur.execute("SELECT id FROM exercises WHERE name = ?", (name,))
-        row = cur.fetchone()
-        return row[0] if row else 0
+        exercise_id = cur.fetchone()[0]
+    
+    _exercise_id_cache[name] = exercise_id
+    return exercise_id
 
 
 def get_all_exercises() -> List[Tuple]:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, name, description FROM exercises ORDER BY name")
         return cur.fetchall()
 
 
 def update_exercise(exercise_id: int, name: str | None = None, description: str | None = None) -> bool:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         
         fields = []
@@ -158,87 +189,108 @@ def update_exercise(exercise_id: int, name: str | None = None, description: str
         query = f"UPDATE exercises SET {', '.join(fields)} WHERE id = ?"
         
         cur.execute(query, values)
-        conn.commit()
+        _exercise_id_cache.clear()
         return cur.rowcount > 0
 
 
 def delete_exercise(exercise_id: int, cascade: bool = True) -> bool:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         
         if cascade:
-            cur.execute("SELECT id FROM sessions WHERE exercise_id = ?", (exercise_id,))
-            session_ids = [row[0] for row in cur.fetchall()]
-            
-            for sid in session_ids:
-                cur.execute("DELETE FROM movement_data WHERE session_id = ?", (sid,))
-                cur.execute("DELETE FROM metrics WHERE session_id = ?", (sid,))
-            
             cur.execute("DELETE FROM sessions WHERE exercise_id = ?", (exercise_id,))
         
         cur.execute("DELETE FROM exercises WHERE id = ?", (exercise_id,))
-        conn.commit()
+        _exercise_id_cache.clear()
         return cur.rowcount > 0
 
 
+@lru_cache(maxsize=1)
+def _video_path_is_generated() -> bool:
+    with read_conn() as conn:
+        info = conn.execute("PRAGMA table_xinfo(sessions)").fetchall()
+    return any(row[1] == "video_path" and row[6] in (2, 3) for row in info)
+
+
 def create_session(
     patient_id: int | None = None,
     exercise_id: int | None = None,
     video_path_raw: str | None = None,
     video_path_mediapipe: str | None = None,
     video_path_legacy: str | None = None,
-    notes: str | None = None
+    notes: str | None = None,
+    overlay_path: str | None = None
 ) -> int:
-    with get_connection() as conn:
+    values = (patient_id, exercise_id,
+              video_path_raw, video_path_mediapipe, video_path_legacy,
+              notes, overlay_path)
+    
+    with writer() as conn:
         cur = conn.cursor()
-        
-        video_path = video_path_legacy or video_path_mediapipe or video_path_raw
-        
-        cur.execute(
-            """
-            INSERT INTO sessions (
-                patient_id, exercise_id, 
-                video_path_raw, video_path_mediapipe, video_path_legacy,
-                video_path, notes
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (patient_id, exercise_id, 
-             video_path_raw, video_path_mediapipe, video_path_legacy,
-             video_path, notes)
-        )
-        conn.commit()
+        if _video_path_is_generated():
+            cur.execute(_SQL_INSERT_SESSION, values)
+        else:
+            video_path = video_path_legacy or video_path_mediapipe or video_path_raw
+            cur.execute(_SQL_INSERT_SESSION_LEGACY, (*values, video_path))
         return cur.lastrowid
 
 
-def get_all_sessions() -> List[Dict[str, Any]]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
+def get_all_sessions(
+    limit: int | None = None,
+    before_ts: str | None = None,
+    before_id: int | None = None
+) -> List[Tuple]:
+    where = []
+    params: List[Any] = []
+    
+    if before_ts is not None and before_id is not None:
+        where.append("(s.timestamp, s.id) < (?, ?)")
+        params.extend((before_ts, before_id))
+    elif before_ts is not None:
+        where.append("s.timestamp < ?")
+        params.append(before_ts)
+    
+    query = """
+        SELECT 
+            s.id,
+            s.timestamp AS datetime,
+            s.video_path,
+            s.video_path_raw,
+            s.video_path_mediapipe,
+            s.video_path_legacy,
+            s.overlay_path,
+            s.notes,
+            p.name AS patient_name,
+            e.name AS exercise_name
+        FROM sessions s
+        LEFT JOIN patients p ON s.patient_id = p.id
+        LEFT JOIN exercises e ON s.exercise_id = e.id
+    """
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    query += " ORDER BY s.timestamp DESC, s.id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    
+    with read_conn() as conn:
         cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT 
-                s.id,
-                s.timestamp AS datetime,
-                s.video_path,
-                s.video_path_raw,
-                s.video_path_mediapipe,
-                s.video_path_legacy,
-                s.notes,
-                p.name AS patient_name,
-                e.name AS exercise_name
-            FROM sessions s
-            LEFT JOIN patients p ON s.patient_id = p.id
-            LEFT JOIN exercises e ON s.exercise_id = e.id
-            ORDER BY s.timestamp DESC
-            """
-        )
-        return [dict(row) for row in cur.fetchall()]
+        cur.execute(query, params)
+        return fetch_rows(cur)
+
 
+def iter_all_sessions(page_size: int = 500) -> Iterator[Tuple]:
+    page = get_all_sessions(limit=page_size)
+    while page:
+        yield from page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+        page = get_all_sessions(limit=page_size, before_ts=last.datetime, before_id=last.id)
 
-def get_sessions_by_patient(patient_id: int) -> List[Dict[str, Any]]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
+
+def get_sessions_by_patient(patient_id: int) -> List[Tuple]:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -249,6 +301,7 @@ def get_sessions_by_patient(patient_id: int) -> List[Dict[str, Any]]:
                 s.video_path_raw,
                 s.video_path_mediapipe,
                 s.video_path_legacy,
+                s.overlay_path,
                 s.notes,
                 e.name AS exercise_name
             FROM sessions s
@@ -258,18 +311,31 @@ def get_sessions_by_patient(patient_id: int) -> List[Dict[str, Any]]:
             """,
             (patient_id,)
         )
-        return [dict(row) for row in cur.fetchall()]
+        return fetch_rows(cur)
+
+
+_SESSION_VIDEO_COLUMNS = {
+    "raw": "video_path_raw",
+    "mediapipe": "video_path_mediapipe",
+    "legacy": "video_path_legacy",
+}
+
+
+def set_session_video_path(session_id: int, kind: str, path: str | None) -> bool:
+    column = _SESSION_VIDEO_COLUMNS.get(kind)
+    if column is None:
+        raise ValueError(f"Tipo de vídeo inválido: {kind}")
+    
+    with writer() as conn:
+        cur = conn.cursor()
+        cur.execute(f"UPDATE sessions SET {column} = ? WHERE id = ?", (path, session_id))
+        return cur.rowcount > 0
 
 
 def delete_session(session_id: int) -> bool:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
-        
-        cur.execute("DELETE FROM movement_data WHERE session_id = ?", (session_id,))
-        cur.execute("DELETE FROM metrics WHERE session_id = ?", (session_id,))
         cur.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-        
-        conn.commit()
         return cur.rowcount > 0
 
 
@@ -277,32 +343,182 @@ def add_movement_data(session_id: int, data: Dict[str, Any]) -> None:
     if not data:
         return
     
-    data["session_id"] = session_id
+    add_movement_data_many(session_id, [data])
+
+
+@lru_cache(maxsize=1)
+def _movement_columns() -> Tuple[str, ...]:
+    with read_conn() as conn:
+        info = conn.execute("PRAGMA table_info(movement_data)").fetchall()
+    return tuple(row[1] for row in info if row[1] not in ("id", "session_id"))
+
+
+@lru_cache(maxsize=1)
+def _allowed_movement_columns() -> frozenset:
+    return frozenset(_movement_columns())
+
+
+@lru_cache(maxsize=1)
+def _quantized_movement_columns() -> frozenset:
+    with read_conn() as conn:
+        info = conn.execute("PRAGMA table_info(movement_data)").fetchall()
+    declared = {row[1]: row[2].upper() for row in info}
+    # Las bases anteriores ya declaraban symmetry_*_y como INTEGER sin escalar:
+    # solo se cuantiza si las coordenadas de landmarks también son INTEGER.
+    if declared.get("shoulder_x_r") != "INTEGER":
+        return frozenset()
+    return frozenset(
+        name for name, decl in declared.items()
+        if decl == "INTEGER" and name not in ("id", "session_id", "frame")
+    )
+
+
+def _movement_placeholder(column: str) -> str:
+    if column in _quantized_movement_columns():
+        return f"CAST(round(? * {MOVEMENT_COORD_SCALE}) AS INTEGER)"
+    return "?"
+
+
+def _movement_select_list(columns: Iterable[str]) -> str:
+    quantized = _quantized_movement_columns()
+    return ", ".join(
+        f"{col} / {MOVEMENT_COORD_SCALE}.0 AS {col}" if col in quantized else col
+        for col in columns
+    )
+
+
+@lru_cache(maxsize=32)
+def _movement_insert_sql(columns: Tuple[str, ...]) -> str:
+    return f"""
+        INSERT INTO movement_data (session_id, {', '.join(columns)})
+        VALUES (?, {', '.join(map(_movement_placeholder, columns))})
+    """
+
+
+def add_movement_data_many(session_id: int, rows: List[Dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    
+    columns = _movement_columns()
+    allowed = _allowed_movement_columns()
+    for row in rows:
+        if not row.keys() <= allowed:
+            unknown = sorted(row.keys() - allowed)
+            raise ValueError(f"Columnas desconocidas en movement_data: {unknown}")
     
-    columns = list(data.keys())
-    placeholders = ["?" for _ in columns]
-    values = [data[col] for col in columns]
+    sql = _movement_insert_sql(columns)
+    for start in range(0, len(rows), MOVEMENT_COMMIT_ROWS):
+        with writer() as conn:
+            conn.executemany(
+                sql,
+                [(session_id, *map(row.get, columns))
+                 for row in rows[start:start + MOVEMENT_COMMIT_ROWS]]
+            )
     
-    query = f"""
-        INSERT INTO movement_data ({', '.join(columns)})
-        VALUES ({', '.join(placeholders)})
-    """
+    return len(rows)
+
+
+def add_movement_data_arrays(
+    session_id: int,
+    columns: List[str],
+    arrays: List[Any],
+    rebuild_indexes: bool = False
+) -> int:
+    if len(columns) != len(arrays):
+        raise ValueError("columns y arrays deben tener la misma longitud")
+    unknown = set(columns) - _allowed_movement_columns()
+    if unknown:
+        raise ValueError(f"Columnas desconocidas en movement_data: {sorted(unknown)}")
+    if not columns:
+        return 0
     
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(query, values)
-        conn.commit()
+    values = [arr.tolist() if hasattr(arr, "tolist") else list(arr) for arr in arrays]
+    n_rows = len(values[0])
+    if any(len(v) != n_rows for v in values):
+        raise ValueError("Todos los arrays deben tener el mismo número de filas")
+    
+    sql = _movement_insert_sql(tuple(columns))
+    session_col = [session_id] * n_rows
+    with bulk_load("movement_data") if rebuild_indexes else nullcontext():
+        for start in range(0, n_rows, MOVEMENT_COMMIT_ROWS):
+            stop = start + MOVEMENT_COMMIT_ROWS
+            with writer() as conn:
+                conn.executemany(
+                    sql,
+                    zip(session_col[start:stop], *(v[start:stop] for v in values))
+                )
+    
+    return n_rows
 
 
-def get_movement_data_by_session(session_id: int) -> List[Dict[str, Any]]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT * FROM movement_data WHERE session_id = ? ORDER BY frame",
-            (session_id,)
-        )
-        return [dict(row) for row in cur.fetchall()]
+def refresh_movement_statistics() -> None:
+    with writer() as conn:
+        conn.execute("PRAGMA analysis_limit = 1000;")
+        conn.execute("ANALYZE movement_data;")
+        conn.execute("ANALYZE sessions;")
+
+
+def checkpoint_wal() -> None:
+    get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+
+@lru_cache(maxsize=1)
+def _movement_select_sql() -> str:
+    return (
+        f"SELECT {_movement_select_list(('id', 'session_id', *_movement_columns()))} "
+        "FROM movement_data WHERE session_id = ? ORDER BY frame"
+    )
+
+
+def iter_movement_data_by_session(session_id: int) -> Iterator[Tuple]:
+    cur = get_connection().cursor()
+    cur.arraysize = 1000
+    cur.execute(_movement_select_sql(), (session_id,))
+    make = row_type(cur)._make
+    for row in cur:
+        yield make(row)
+
+
+def get_movement_data_by_session(session_id: int) -> List[Tuple]:
+    return list(iter_movement_data_by_session(session_id))
+
+
+@lru_cache(maxsize=1)
+def _movement_matrix_sql() -> str:
+    return (
+        f"SELECT {_movement_select_list(_movement_columns())} FROM movement_data "
+        "WHERE session_id = ? ORDER BY frame"
+    )
+
+
+def get_movement_matrix(session_id: int) -> Tuple[List[str], np.ndarray]:
+    columns = list(_movement_columns())
+    cur = get_connection().cursor()
+    cur.row_factory = None
+    cur.arraysize = MOVEMENT_FETCH_ROWS
+    cur.execute(_movement_matrix_sql(), (session_id,))
+    
+    blocks = []
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            break
+        blocks.append(np.array(rows, dtype=np.float64))
+    
+    if not blocks:
+        return columns, np.empty((0, len(columns)), dtype=np.float64)
+    return columns, blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+
+def get_movement_data_columnar(session_id: int) -> Dict[str, np.ndarray]:
+    columns, matrix = get_movement_matrix(session_id)
+    return dict(zip(columns, np.ascontiguousarray(matrix.T)))
+
+
+def movement_dataframe_by_session(session_id: int):
+    import pandas as pd
+    
+    return pd.read_sql_query(_movement_select_sql(), get_connection(), params=(session_id,))
 
 
 def add_metric(
@@ -311,20 +527,26 @@ def add_metric(
     metric_value: float,
     unit: str | None = None
 ) -> None:
-    with get_connection() as conn:
+    add_metrics_bulk(session_id, [(metric_name, metric_value, unit)])
+
+
+def add_metrics_bulk(
+    session_id: int,
+    rows: Iterable[Tuple[str, float, str | None]]
+) -> int:
+    values = [(session_id, name, value, unit) for name, value, unit in rows]
+    if not values:
+        return 0
+    
+    with writer() as conn:
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO metrics (session_id, metric_name, metric_value, unit)
-            VALUES (?, ?, ?, ?)
-            """,
-            (session_id, metric_name, metric_value, unit)
-        )
-        conn.commit()
+        cur.executemany(_SQL_INSERT_METRIC, values)
+    
+    return len(values)
 
 
 def get_metrics_by_session(session_id: int) -> List[Tuple[str, float, str]]:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT metric_name, metric_value, unit FROM metrics WHERE session_id = ? ORDER BY metric_name",
@@ -333,16 +555,17 @@ def get_metrics_by_session(session_id: int) -> List[Tuple[str, float, str]]:
         return cur.fetchall()
 
 
+_SQL_TABLE_COUNTS = " UNION ALL ".join(
+    f"SELECT '{table}', (SELECT COUNT(*) FROM {table})"
+    for table in ("patients", "exercises", "sessions", "metrics")
+)
+
+
 def get_table_counts() -> Dict[str, int]:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
-        
-        counts = {}
-        for table in ["patients", "exercises", "sessions", "metrics"]:
-            cur.execute(f"SELECT COUNT(*) FROM {table}")
-            counts[table] = cur.fetchone()[0]
-        
-        return counts
+        cur.execute(_SQL_TABLE_COUNTS)
+        return dict(cur.fetchall())
 
 
 from db import feedback_crud
@@ -1,6 +1,8 @@
-import sqlite3
-from typing import List, Dict, Any, Tuple
-from db.init_db import get_connection
+from typing import List, Dict, Tuple
+from db.init_db import read_conn, writer, fetch_rows, row_type
+
+FEEDBACK_STATUSES = ('pending', 'reviewed', 'resolved')
+_VALID_FEEDBACK_STATUS = frozenset(FEEDBACK_STATUSES)
 
 
 def create_feedback(
@@ -11,7 +13,7 @@ def create_feedback(
     user_agent: str | None = None,
     screen_resolution: str | None = None
 ) -> int:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -23,42 +25,48 @@ def create_feedback(
             """,
             (component, feedback_type, title, description, user_agent, screen_resolution)
         )
-        conn.commit()
         return cur.lastrowid
 
 
-def get_all_feedback(status: str | None = None) -> List[Dict[str, Any]]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
+def get_all_feedback(
+    status: str | None = None,
+    limit: int | None = None,
+    before_ts: str | None = None,
+    before_id: int | None = None
+) -> List[Tuple]:
+    where = []
+    params = []
+    
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if before_ts is not None and before_id is not None:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend((before_ts, before_id))
+    elif before_ts is not None:
+        where.append("created_at < ?")
+        params.append(before_ts)
+    
+    query = """
+        SELECT id, component, feedback_type, title, description,
+               user_agent, screen_resolution, status, created_at
+        FROM feedback
+    """
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    
+    with read_conn() as conn:
         cur = conn.cursor()
-        
-        if status:
-            cur.execute(
-                """
-                SELECT id, component, feedback_type, title, description,
-                       user_agent, screen_resolution, status, created_at
-                FROM feedback
-                WHERE status = ?
-                ORDER BY created_at DESC
-                """,
-                (status,)
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, component, feedback_type, title, description,
-                       user_agent, screen_resolution, status, created_at
-                FROM feedback
-                ORDER BY created_at DESC
-                """
-            )
-        
-        return [dict(row) for row in cur.fetchall()]
+        cur.execute(query, params)
+        return fetch_rows(cur)
 
 
-def get_feedback_by_id(feedback_id: int) -> Dict[str, Any] | None:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
+def get_feedback_by_id(feedback_id: int) -> Tuple | None:
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -70,47 +78,36 @@ def get_feedback_by_id(feedback_id: int) -> Dict[str, Any] | None:
             (feedback_id,)
         )
         row = cur.fetchone()
-        return dict(row) if row else None
+        return row_type(cur)._make(row) if row else None
 
 
 def update_feedback_status(feedback_id: int, status: str) -> bool:
-    if status not in ('pending', 'reviewed', 'resolved'):
+    if status not in _VALID_FEEDBACK_STATUS:
         raise ValueError(f"Estado inválido: {status}")
     
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE feedback SET status = ? WHERE id = ?",
             (status, feedback_id)
         )
-        conn.commit()
         return cur.rowcount > 0
 
 
 def delete_feedback(feedback_id: int) -> bool:
-    with get_connection() as conn:
+    with writer() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM feedback WHERE id = ?", (feedback_id,))
-        conn.commit()
         return cur.rowcount > 0
 
 
 def get_feedback_stats() -> Dict[str, int]:
-    with get_connection() as conn:
+    with read_conn() as conn:
         cur = conn.cursor()
-        
-        stats = {}
-        
-        cur.execute("SELECT COUNT(*) FROM feedback")
-        stats['total'] = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM feedback WHERE status = 'pending'")
-        stats['pending'] = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM feedback WHERE status = 'reviewed'")
-        stats['reviewed'] = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM feedback WHERE status = 'resolved'")
-        stats['resolved'] = cur.fetchone()[0]
-        
-        return stats
\ No newline at end of file
+        cur.execute("SELECT status, COUNT(*) FROM feedback GROUP BY status")
+        by_status = dict(cur.fetchall())
+    
+    stats = {'total': sum(by_status.values())}
+    for status in FEEDBACK_STATUSES:
+        stats[status] = by_status.get(status, 0)
+    return stats
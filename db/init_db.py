@@ -1,74 +1,244 @@
-import sqlite3
+import atexit
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import pysqlite3.dbapi2 as sqlite3
+except ImportError:
+    import sqlite3
+
+from core.logger import get_logger
 from core.path_manager import get_db_path, get_database_dir
 from db import models
 
+log = get_logger("db.init")
+
 DB_PATH = get_db_path()
+SCHEMA_SENTINEL = get_database_dir() / ".schema_ok"
+SCHEMA_HASH = hashlib.sha256(repr((models.TABLES, models.ADDED_COLUMNS, models.MIGRATIONS)).encode()).hexdigest()
+
+_tls = threading.local()
+_open_connections = {}
+_registry_lock = threading.Lock()
+_db_dir_ready = False
+
+REQUIRED_TABLE_NAMES = [name for name, _, _ in models.TABLES]
+
+_REQUIRED_TABLES_SQL = (
+    "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN "
+    f"({', '.join('?' for _ in REQUIRED_TABLE_NAMES)})"
+)
+
+
+STATEMENT_CACHE_SIZE = 256
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+SQLITE_SYNCHRONOUS = os.environ.get("RECONIA_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+if SQLITE_SYNCHRONOUS not in SYNCHRONOUS_MODES:
+    SQLITE_SYNCHRONOUS = "NORMAL"
+
+CONNECTION_PRAGMAS = (
+    f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS};",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA wal_autocheckpoint = 1000;",
+    "PRAGMA foreign_keys = ON;",
+)
+
+
+PERSISTENT_PRAGMAS = (
+    "PRAGMA page_size = 8192;",
+    "PRAGMA auto_vacuum = INCREMENTAL;",
+    "PRAGMA journal_mode = WAL;",
+)
+
+
+def _apply_persistent_pragmas(conn):
+    conn.executescript("\n".join(PERSISTENT_PRAGMAS))
+
+
+def _configure(conn):
+    conn.executescript("\n".join(CONNECTION_PRAGMAS))
+    conn.row_factory = sqlite3.Row
+    return conn
 
-def _extract_table_name(stmt):
-    parts = stmt.split()
+
+def get_connection():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        return conn
+
+    global _db_dir_ready
+    if not _db_dir_ready:
+        get_database_dir().mkdir(parents=True, exist_ok=True)
+        _db_dir_ready = True
+
+    conn = _configure(sqlite3.connect(
+        str(DB_PATH),
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        isolation_level=None,
+    ))
+    _tls.conn = conn
+    with _registry_lock:
+        for thread in [t for t in _open_connections if not t.is_alive()]:
+            _open_connections.pop(thread).close()
+        _open_connections[threading.current_thread()] = conn
+    return conn
+
+
+@contextmanager
+def read_conn():
+    yield get_connection()
+
+
+@contextmanager
+def writer():
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE;")
     try:
-        idx = parts.index("TABLE")
-        for i in range(idx + 1, len(parts)):
-            if parts[i] not in ("IF", "NOT", "EXISTS"):
-                return parts[i].replace("(", "").strip()
-    except (ValueError, IndexError):
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
+
+def _optimize_and_close(conn):
+    try:
+        conn.execute("PRAGMA optimize;")
+    except sqlite3.Error:
         pass
-    return None
+    conn.close()
 
-REQUIRED_TABLE_NAMES = [
-    name for name in (_extract_table_name(stmt) for stmt in models.TABLES) if name
-]
 
+def close_connection():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        _tls.conn = None
+        with _registry_lock:
+            _open_connections.pop(threading.current_thread(), None)
+        _optimize_and_close(conn)
 
-def get_connection():
-    db_dir = get_database_dir()
-    db_dir.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+@atexit.register
+def close_all_connections():
+    with _registry_lock:
+        for conn in _open_connections.values():
+            _optimize_and_close(conn)
+        _open_connections.clear()
 
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
 
-    return conn
+@lru_cache(maxsize=64)
+def _row_type(fields):
+    return namedtuple("Row", fields, rename=True)
+
+
+def row_type(cursor):
+    return _row_type(tuple(col[0] for col in cursor.description))
+
+
+def fetch_rows(cursor):
+    return list(map(row_type(cursor)._make, cursor.fetchall()))
+
+
+def _ddl_script(statements):
+    return "BEGIN;\n" + "\n".join(statements) + "\nCOMMIT;"
+
+
+def create_indexes(conn):
+    conn.executescript(_ddl_script(models.INDEXES))
+
+
+def drop_indexes(conn, table):
+    names = [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+            (table,)
+        )
+    ]
+    conn.executescript(_ddl_script(f'DROP INDEX IF EXISTS "{name}";' for name in names))
+
+
+@contextmanager
+def bulk_load(table):
+    conn = get_connection()
+    drop_indexes(conn, table)
+    try:
+        yield conn
+    finally:
+        create_indexes(conn)
+
+
+def _migrate(conn):
+    for table, column, decl in models.ADDED_COLUMNS:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl};")
+            log.info("Added column %s.%s", table, column)
+    conn.executescript(_ddl_script(models.MIGRATIONS))
 
 
 def init_database():
     conn = get_connection()
     try:
-        cursor = conn.cursor()
-        for table_sql in models.TABLES:
-            cursor.execute(table_sql)
-        conn.commit()
-        print(f"[init_db] Database successfully initialized at: {DB_PATH}")
+        _apply_persistent_pragmas(conn)
+        conn.executescript(_ddl_script(sql for _, sql, _ in models.TABLES))
+        _migrate(conn)
+        create_indexes(conn)
+        log.info("Database initialized at: %s", DB_PATH)
     except sqlite3.Error as e:
-        print(f"[init_db] SQLite error during initialization: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        log.error("SQLite error during initialization: %s", e)
         raise
-    finally:
-        conn.close()
+
+
+def _schema_is_current():
+    try:
+        return SCHEMA_SENTINEL.read_text(encoding="utf-8") == SCHEMA_HASH
+    except OSError:
+        return False
+
+
+def _mark_schema_current():
+    try:
+        SCHEMA_SENTINEL.write_text(SCHEMA_HASH, encoding="utf-8")
+    except OSError as e:
+        log.warning("Could not write schema sentinel %s: %s", SCHEMA_SENTINEL, e)
 
 
 def ensure_database_exists():
     if not DB_PATH.exists():
-        print(f"[init_db] Database file not found. Creating at: {DB_PATH}")
+        log.info("Database file not found. Creating at: %s", DB_PATH)
         init_database()
+        _mark_schema_current()
         return
 
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        existing_table_names = {row[0] for row in cursor.fetchall()}
-
-    finally:
-        conn.close()
-
-    missing = [t for t in REQUIRED_TABLE_NAMES if t not in existing_table_names]
+    if _schema_is_current():
+        return
 
-    if missing:
-        print(f"[init_db] Missing tables detected: {missing}")
-        print("[init_db] Creating missing tables...")
+    conn = get_connection()
+    found = conn.execute(_REQUIRED_TABLES_SQL, REQUIRED_TABLE_NAMES).fetchone()[0]
+
+    if found != len(REQUIRED_TABLE_NAMES):
+        existing_table_names = {
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        }
+        missing = [t for t in REQUIRED_TABLE_NAMES if t not in existing_table_names]
+        log.warning("Missing tables detected: %s", missing)
         init_database()
     else:
-        print(f"[init_db] Database OK at: {DB_PATH}")
\ No newline at end of file
+        if conn.execute("PRAGMA journal_mode;").fetchone()[0].lower() != "wal":
+            conn.execute("PRAGMA journal_mode = WAL;")
+        _migrate(conn)
+        create_indexes(conn)
+        log.info("Database OK at: %s", DB_PATH)
+    _mark_schema_current()
\ No newline at end of file
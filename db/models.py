@@ -4,7 +4,7 @@ CREATE TABLE IF NOT EXISTS patients (
     name TEXT NOT NULL,
     dni TEXT UNIQUE,
     age INTEGER,
-    gender TEXT CHECK(gender IN ('M', 'F', 'Other')),
+    gender TEXT,
     notes TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -27,7 +27,14 @@ CREATE TABLE IF NOT EXISTS sessions (
     video_path_raw TEXT,
     video_path_mediapipe TEXT,
     video_path_legacy TEXT,
-    video_path TEXT,
+    overlay_path TEXT,
+    video_path TEXT GENERATED ALWAYS AS (
+        COALESCE(
+            NULLIF(video_path_legacy, ''),
+            NULLIF(video_path_mediapipe, ''),
+            NULLIF(video_path_raw, '')
+        )
+    ) VIRTUAL,
     
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     notes TEXT,
@@ -43,38 +50,38 @@ CREATE TABLE IF NOT EXISTS movement_data (
     time_seconds REAL,
     frame INTEGER,
 
-    shoulder_x_r REAL, shoulder_y_r REAL,
-    elbow_x_r REAL, elbow_y_r REAL,
-    wrist_x_r REAL, wrist_y_r REAL,
+    shoulder_x_r INTEGER, shoulder_y_r INTEGER,
+    elbow_x_r INTEGER, elbow_y_r INTEGER,
+    wrist_x_r INTEGER, wrist_y_r INTEGER,
     angle_arm_r REAL,
 
-    shoulder_x_l REAL, shoulder_y_l REAL,
-    elbow_x_l REAL, elbow_y_l REAL,
-    wrist_x_l REAL, wrist_y_l REAL,
+    shoulder_x_l INTEGER, shoulder_y_l INTEGER,
+    elbow_x_l INTEGER, elbow_y_l INTEGER,
+    wrist_x_l INTEGER, wrist_y_l INTEGER,
     angle_arm_l REAL,
 
-    hip_x_r REAL, hip_y_r REAL,
-    knee_x_r REAL, knee_y_r REAL,
-    ankle_x_r REAL, ankle_y_r REAL,
+    hip_x_r INTEGER, hip_y_r INTEGER,
+    knee_x_r INTEGER, knee_y_r INTEGER,
+    ankle_x_r INTEGER, ankle_y_r INTEGER,
     angle_leg_r REAL,
 
-    heel_x_r REAL, heel_y_r REAL,
-    foot_index_x_r REAL, foot_index_y_r REAL,
+    heel_x_r INTEGER, heel_y_r INTEGER,
+    foot_index_x_r INTEGER, foot_index_y_r INTEGER,
 
-    hip_x_l REAL, hip_y_l REAL,
-    knee_x_l REAL, knee_y_l REAL,
-    ankle_x_l REAL, ankle_y_l REAL,
+    hip_x_l INTEGER, hip_y_l INTEGER,
+    knee_x_l INTEGER, knee_y_l INTEGER,
+    ankle_x_l INTEGER, ankle_y_l INTEGER,
     angle_leg_l REAL,
 
-    heel_x_l REAL, heel_y_l REAL,
-    foot_index_x_l REAL, foot_index_y_l REAL,
+    heel_x_l INTEGER, heel_y_l INTEGER,
+    foot_index_x_l INTEGER, foot_index_y_l INTEGER,
 
     symmetry_angle_arm REAL,
     symmetry_angle_leg REAL,
     
-    symmetry_shoulder_y REAL,
-    symmetry_elbow_y REAL,
-    symmetry_knee_y REAL,
+    symmetry_shoulder_y INTEGER,
+    symmetry_elbow_y INTEGER,
+    symmetry_knee_y INTEGER,
 
     FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
 );
@@ -106,10 +113,31 @@ CREATE TABLE IF NOT EXISTS feedback (
 """
 
 TABLES = [
-    CREATE_TABLE_PATIENTS,
-    CREATE_TABLE_EXERCISES,
-    CREATE_TABLE_SESSIONS,
-    CREATE_TABLE_MOVEMENT_DATA,
-    CREATE_TABLE_METRICS,
-    CREATE_TABLE_FEEDBACK,
-]
\ No newline at end of file
+    ("patients", CREATE_TABLE_PATIENTS, []),
+    ("exercises", CREATE_TABLE_EXERCISES, []),
+    ("sessions", CREATE_TABLE_SESSIONS, [
+        "CREATE INDEX IF NOT EXISTS idx_sessions_patient_ts ON sessions(patient_id, timestamp DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_exercise ON sessions(exercise_id);",
+    ]),
+    ("movement_data", CREATE_TABLE_MOVEMENT_DATA, [
+        "CREATE INDEX IF NOT EXISTS idx_movement_session_frame ON movement_data(session_id, frame);",
+    ]),
+    ("metrics", CREATE_TABLE_METRICS, [
+        "CREATE INDEX IF NOT EXISTS idx_metrics_session_name ON metrics(session_id, metric_name);",
+    ]),
+    ("feedback", CREATE_TABLE_FEEDBACK, [
+        "CREATE INDEX IF NOT EXISTS idx_feedback_status_time ON feedback(status, created_at DESC);",
+    ]),
+]
+
+INDEXES = [stmt for _, _, indexes in TABLES for stmt in indexes]
+
+# Columnas añadidas después de la primera versión del esquema: (tabla, columna, tipo).
+ADDED_COLUMNS = [
+    ("sessions", "overlay_path", "TEXT"),
+]
+
+# Pasos de migración idempotentes para bases de datos creadas por versiones anteriores.
+MIGRATIONS = [
+    "DROP INDEX IF EXISTS idx_metrics_session;",
+]
@@ -1,17 +1,15 @@
 import io
 import datetime
-import sqlite3
 from typing import Dict, Tuple, List
 
 import matplotlib.pyplot as plt
 
-from db.init_db import get_connection
+from db.init_db import read_conn
 from db import crud
 
 
 def _fetch_session_bundle(session_id: int) -> Dict:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
+    with read_conn() as conn:
         cur = conn.cursor()
         cur.execute(
             """
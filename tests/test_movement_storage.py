@@ -0,0 +1,121 @@
+import re
+import sqlite3
+
+import numpy as np
+import pytest
+
+from db import crud, init_db, models
+
+COORD_TOLERANCE = 0.1
+
+ROW = {
+    "frame": 0,
+    "time_seconds": 0.25,
+    "shoulder_x_r": 640.04,
+    "shoulder_y_r": 359.96,
+    "elbow_x_r": 12.3456,
+    "angle_arm_r": 87.654,
+    "symmetry_shoulder_y": 3.21,
+}
+
+ARRAY_ROW = {
+    "frame": 1,
+    "time_seconds": 0.30,
+    "shoulder_x_r": 1919.95,
+    "shoulder_y_r": 0.04,
+    "elbow_x_r": 100.5,
+    "angle_arm_r": 12.5,
+    "symmetry_shoulder_y": 0.0,
+}
+
+COORDS = ("shoulder_x_r", "shoulder_y_r", "elbow_x_r", "symmetry_shoulder_y")
+
+
+def _legacy_movement_table():
+    # Antes de la cuantización las coordenadas de landmarks se declaraban REAL.
+    return re.sub(r"\b(\w+_[xy]_[rl]) INTEGER\b", r"\1 REAL", models.CREATE_TABLE_MOVEMENT_DATA)
+
+
+def _reset_db_state():
+    init_db.close_connection()
+    for func in vars(crud).values():
+        if hasattr(func, "cache_clear"):
+            func.cache_clear()
+    crud._exercise_id_cache.clear()
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = tmp_path / "sessions.db"
+    monkeypatch.setattr(init_db, "DB_PATH", path)
+    monkeypatch.setattr(init_db, "SCHEMA_SENTINEL", tmp_path / ".schema_ok")
+    _reset_db_state()
+    yield path
+    _reset_db_state()
+
+
+def _stored(session_id):
+    rows = crud.get_movement_data_by_session(session_id)
+    columns, matrix = crud.get_movement_matrix(session_id)
+    columnar = crud.get_movement_data_columnar(session_id)
+    return rows, columns, matrix, columnar
+
+
+def _assert_rows(session_id, expected, tolerance):
+    rows, columns, matrix, columnar = _stored(session_id)
+    assert [row.frame for row in rows] == [r["frame"] for r in expected]
+    for i, exp in enumerate(expected):
+        for key, value in exp.items():
+            assert getattr(rows[i], key) == pytest.approx(value, abs=tolerance), key
+            assert matrix[i, columns.index(key)] == pytest.approx(value, abs=tolerance), key
+            assert columnar[key][i] == pytest.approx(value, abs=tolerance), key
+
+
+def test_fresh_database_quantizes_coordinates(db_path):
+    init_db.ensure_database_exists()
+    sid = crud.create_session(
+        patient_id=crud.create_patient("Paciente"),
+        exercise_id=crud.create_exercise("Sentadilla"),
+    )
+
+    crud.add_movement_data_many(sid, [ROW])
+    columns = list(ARRAY_ROW)
+    crud.add_movement_data_arrays(sid, columns, [np.array([ARRAY_ROW[c]]) for c in columns])
+
+    _assert_rows(sid, [ROW, ARRAY_ROW], COORD_TOLERANCE)
+
+    conn = sqlite3.connect(db_path)
+    stored = conn.execute(
+        "SELECT typeof(shoulder_x_r), shoulder_x_r, typeof(angle_arm_r) "
+        "FROM movement_data WHERE frame = 0"
+    ).fetchone()
+    conn.close()
+    assert stored == ("integer", 6400, "real")
+
+
+def test_legacy_real_columns_are_read_unscaled(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript("\n".join(
+        _legacy_movement_table() if name == "movement_data" else sql
+        for name, sql, _ in models.TABLES
+    ))
+    conn.execute("INSERT INTO patients (name) VALUES ('Paciente')")
+    conn.execute("INSERT INTO exercises (name) VALUES ('Sentadilla')")
+    conn.execute("INSERT INTO sessions (patient_id, exercise_id) VALUES (1, 1)")
+    conn.execute(
+        f"INSERT INTO movement_data (session_id, {', '.join(ROW)}) "
+        f"VALUES (1, {', '.join('?' for _ in ROW)})",
+        tuple(ROW.values())
+    )
+    conn.commit()
+    conn.close()
+
+    init_db.ensure_database_exists()
+    assert crud._quantized_movement_columns() == frozenset()
+
+    crud.add_movement_data_many(1, [ARRAY_ROW])
+
+    _assert_rows(1, [ROW, ARRAY_ROW], 1e-9)
+    rows, _, _, _ = _stored(1)
+    for key in COORDS:
+        assert getattr(rows[0], key) == ROW[key]
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+import pytest
+
+from core import session_manager
+from core.session_manager import _PipeWriter, _write_all
+
+# Mayor que el buffer de un pipe del SO: el primer write bloquea el hilo de
+# escritura hasta que alguien lea, lo que permite llenar la cola a voluntad.
+FRAME_SIZE = 1 << 20
+
+
+class _FakeProcess:
+
+    def __init__(self, write_fd):
+        self.stdin = os.fdopen(write_fd, "wb", buffering=0)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    process = _FakeProcess(write_fd)
+    received = bytearray()
+
+    def drain():
+        while True:
+            chunk = os.read(read_fd, 1 << 16)
+            if not chunk:
+                return
+            received.extend(chunk)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    yield process, reader, received
+    process.stdin.close()
+    if reader.ident is not None:
+        reader.join(timeout=5)
+    os.close(read_fd)
+
+
+def _frame(value):
+    return bytearray([value]) * FRAME_SIZE
+
+
+def _fill(writer, count):
+    # El primer frame queda bloqueado en el write; el resto llena la cola.
+    for value in range(count):
+        buf = writer.acquire(FRAME_SIZE)
+        assert buf is not None
+        buf[:] = _frame(value)
+        assert writer.submit(buf)
+        time.sleep(0.05)
+
+
+def test_realtime_writer_drops_instead_of_blocking(pipe):
+    process, reader, received = pipe
+    writer = _PipeWriter(process, "raw", FRAME_SIZE, queue_size=1, realtime=True)
+    _fill(writer, 2)
+
+    start = time.monotonic()
+    assert writer.acquire(FRAME_SIZE) is None
+    assert writer.submit(_frame(9)) is False
+    assert time.monotonic() - start < 0.5
+
+    reader.start()
+    writer.stop()
+    process.stdin.close()
+    reader.join(timeout=5)
+    assert received == _frame(0) + _frame(1)
+    assert not writer.broken
+
+
+def test_blocking_writer_waits_for_the_encoder(pipe):
+    process, reader, received = pipe
+    writer = _PipeWriter(process, "raw", FRAME_SIZE, queue_size=1, realtime=False)
+    _fill(writer, 2)
+
+    results = []
+
+    def produce():
+        buf = writer.acquire(FRAME_SIZE)
+        buf[:] = _frame(2)
+        results.append(writer.submit(buf))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(timeout=0.3)
+    assert producer.is_alive()
+
+    reader.start()
+    producer.join(timeout=5)
+    assert results == [True]
+
+    writer.stop()
+    process.stdin.close()
+    reader.join(timeout=5)
+    assert received == _frame(0) + _frame(1) + _frame(2)
+    assert writer.dropped == 0
+
+
+def test_stop_gives_up_when_the_writer_is_stuck(pipe):
+    process, reader, _ = pipe
+    writer = _PipeWriter(process, "raw", FRAME_SIZE, queue_size=1, realtime=True)
+    _fill(writer, 2)
+
+    start = time.monotonic()
+    writer.stop(timeout=0.2)
+    assert time.monotonic() - start < 1.0
+    assert writer.broken
+
+    reader.start()
+
+
+def test_drain_batches_queued_frames_into_one_writev(pipe, monkeypatch):
+    process, reader, received = pipe
+    batches = []
+    real_writev = os.writev
+
+    def spy_writev(fd, bufs):
+        batches.append(len(bufs))
+        return real_writev(fd, bufs)
+
+    monkeypatch.setattr(session_manager.os, "writev", spy_writev)
+    writer = _PipeWriter(process, "raw", FRAME_SIZE, queue_size=4, realtime=True)
+    _fill(writer, 5)
+
+    reader.start()
+    writer.stop()
+    process.stdin.close()
+    reader.join(timeout=5)
+    assert received == b"".join(_frame(v) for v in range(5))
+    assert max(batches) > 1
+
+
+def test_write_all_finishes_partial_writev(monkeypatch):
+    read_fd, write_fd = os.pipe()
+    bufs = [bytearray(b"abcdef"), bytearray(b"ghij"), bytearray(b"klm")]
+
+    # Solo escribe 8 bytes: termina el primer buffer y corta el segundo.
+    monkeypatch.setattr(
+        session_manager.os, "writev", lambda fd, views: os.write(fd, b"".join(views)[:8])
+    )
+    try:
+        _write_all(write_fd, bufs)
+        os.close(write_fd)
+        data = b""
+        while chunk := os.read(read_fd, 64):
+            data += chunk
+    finally:
+        os.close(read_fd)
+    assert data == b"abcdefghijklm"
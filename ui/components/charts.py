@@ -34,7 +34,6 @@ def app():
             LIMIT 10
         """)
         sessions = cursor.fetchall()
-        conn.close()
 
         if sessions:
             df_sessions = pd.DataFrame(sessions, columns=["ID", "Fecha", "Paciente", "Ejercicio"])
@@ -1,12 +1,19 @@
 import os
 import datetime
 from datetime import date
+from pathlib import Path
 import streamlit as st
 import pandas as pd
 
 from db import crud
+from core.overlay_renderer import render_overlay_video
 from reports.pdf_report import generate_session_report_pdf
 
+OVERLAY_VERSIONS = {
+    "Overlay clínico": "legacy",
+    "MediaPipe completo": "mediapipe",
+}
+
 
 def _resolve_video_path(relative_path):
     if not relative_path:
@@ -27,14 +34,28 @@ def _resolve_video_path(relative_path):
     return None
 
 
+def _overlay_output_path(raw_path, kind):
+    raw = Path(raw_path)
+    if "_raw_" in raw.name:
+        return str(raw.with_name(raw.name.replace("_raw_", f"_{kind}_", 1)))
+    return str(raw.with_name(f"{raw.stem}_{kind}{raw.suffix}"))
+
+
+def _regenerate_overlay(sid, raw_path, sidecar_path, kind):
+    output_path = _overlay_output_path(raw_path, kind)
+    rendered = render_overlay_video(raw_path, sidecar_path, output_path, kind=kind)
+    crud.set_session_video_path(sid, kind, output_path)
+    return output_path, rendered
+
+
 def _filter_sessions(sessions, selected_patient, selected_exercise, date_range):
     filtered = list(sessions)
     
     if selected_patient not in ("Todos", "No hay pacientes"):
-        filtered = [s for s in filtered if s.get("patient_name") == selected_patient]
+        filtered = [s for s in filtered if s.patient_name == selected_patient]
     
     if selected_exercise not in ("Todos", "No hay ejercicios"):
-        filtered = [s for s in filtered if s.get("exercise_name") == selected_exercise]
+        filtered = [s for s in filtered if s.exercise_name == selected_exercise]
     
     start_date = end_date = None
     if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
@@ -49,7 +70,7 @@ def _filter_sessions(sessions, selected_patient, selected_exercise, date_range):
             dt = pd.to_datetime(dt_str, errors="coerce")
             return pd.notna(dt) and start_date <= dt.date() <= end_date
         
-        filtered = [s for s in filtered if s.get("datetime") and _in_range(s["datetime"])]
+        filtered = [s for s in filtered if s.datetime and _in_range(s.datetime)]
     
     return filtered
 
@@ -95,15 +116,16 @@ def app():
     st.subheader("Sesiones")
 
     for s in filtered_sessions:
-        sid = s.get("id")
-        timestamp = s.get("datetime")
-        patient_name = s.get("patient_name")
-        exercise_name = s.get("exercise_name")
-        notes = s.get("notes")
+        sid = s.id
+        timestamp = s.datetime
+        patient_name = s.patient_name
+        exercise_name = s.exercise_name
+        notes = s.notes
         
-        video_path_raw = s.get("video_path_raw")
-        video_path_mediapipe = s.get("video_path_mediapipe")
-        video_path_legacy = s.get("video_path_legacy")
+        video_path_raw = s.video_path_raw
+        video_path_mediapipe = s.video_path_mediapipe
+        video_path_legacy = s.video_path_legacy
+        overlay_path = s.overlay_path
 
         with st.expander(f"Sesión {sid} — {patient_name} / {exercise_name} — {timestamp}"):
             st.markdown(f"**Paciente:** {patient_name}")
@@ -142,6 +164,27 @@ def app():
                 st.video(video_path)
                 st.caption(f"{os.path.basename(video_path)}")
 
+            sidecar_resolved = _resolve_video_path(overlay_path)
+            if raw_resolved and sidecar_resolved:
+                col_regen = st.columns([2, 1])
+                with col_regen[0]:
+                    regen_version = st.selectbox(
+                        "Regenerar vídeo desde los overlays guardados:",
+                        list(OVERLAY_VERSIONS.keys()),
+                        key=f"regen_version_{sid}"
+                    )
+                with col_regen[1]:
+                    if st.button("Regenerar vídeo", key=f"regen_{sid}"):
+                        try:
+                            with st.spinner("Regenerando vídeo..."):
+                                output_path, rendered = _regenerate_overlay(
+                                    sid, raw_resolved, sidecar_resolved, OVERLAY_VERSIONS[regen_version]
+                                )
+                            st.success(f"{os.path.basename(output_path)} ({rendered} frames)")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error al regenerar vídeo: {e}")
+
             st.markdown("---")
             col_actions = st.columns(3)
             
@@ -179,7 +222,7 @@ def app():
                     with cc[0]:
                         if st.button("Sí", key=f"yes_{sid}"):
                             crud.delete_session(sid)
-                            for path in [video_path_raw, video_path_mediapipe, video_path_legacy]:
+                            for path in [video_path_raw, video_path_mediapipe, video_path_legacy, overlay_path]:
                                 resolved = _resolve_video_path(path)
                                 if resolved:
                                     try:
@@ -1,5 +1,7 @@
 import os
+import queue
 import tempfile
+import threading
 import datetime
 import time
 import cv2
@@ -14,11 +16,11 @@ logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").set
 
 from db import crud
 from core.session_manager import SessionManager
-from core.pose_detection import PoseDetector
+from core.pose_detection import PoseDetector, LANDMARK_INDEX
 from core.video_capture import VideoCaptureManager
 from core.legacy_overlay import draw_legacy_overlay
 from core.utils import safe_round
-from core.angle_calculator import calculate_angle
+from core.angle_kernels import four_angles, warm_up as warm_up_angle_kernel
 from core.logger import get_logger
 
 log = get_logger("ui.sessions")
@@ -38,6 +40,11 @@ except ImportError as e:
     _WEBRTC_OK = False
 
 TARGET_FPS = 20
+ANALYSIS_QUEUE_SIZE = 4
+LOW_DISK_WARNING = (
+    "Espacio en disco agotado: la grabación de vídeo se detuvo antes de terminar la sesión. "
+    "Los datos articulares se han guardado completos."
+)
 
 def _draw_sequence_text(image_bgr, sequence: int) -> None:
     font = cv2.FONT_HERSHEY_SIMPLEX
@@ -47,6 +54,30 @@ def _draw_sequence_text(image_bgr, sequence: int) -> None:
     text = f'Secuencia: {sequence}'
     cv2.putText(image_bgr, text, (20, 30), font, font_scale, (255, 0, 0), thickness, cv2.LINE_AA)
 
+def _session_writer(sess: SessionManager, write_q: queue.Queue) -> None:
+    while True:
+        item = write_q.get()
+        if item is None:
+            return
+        idx, elapsed, joint_data, lm, angles, frame_raw, frame_mediapipe, frame_legacy = item
+        if joint_data:
+            try:
+                sess.record_frame_data(frame_index=idx, elapsed_time=elapsed, joints=joint_data)
+            except Exception:
+                log.exception("Error al registrar frame %s", idx)
+        try:
+            sequence = sess.get_sequence_counter()
+            raw_written = sess.write_video_frames(
+                frame_raw=frame_raw,
+                frame_mediapipe=frame_mediapipe,
+                frame_legacy=frame_legacy
+            )
+            if sess.overlay_sidecar and raw_written:
+                sess.record_overlay(idx, sequence, lm, angles)
+        except Exception:
+            log.exception("Error al escribir el frame %s", idx)
+
+
 def _init_state():
     st.session_state.setdefault("record_mode", False)
     st.session_state.setdefault("paused", False)
@@ -60,6 +91,7 @@ def _init_state():
     st.session_state.setdefault("generate_raw", False)
     st.session_state.setdefault("generate_mediapipe", False)
     st.session_state.setdefault("generate_legacy", True)
+    st.session_state.setdefault("overlay_sidecar", False)
 
 def _overlay_rec(image_bgr, paused=False, landmarks_found=False):
     color = (0, 0, 255) if not paused else (0, 165, 255)
@@ -82,94 +114,63 @@ def _safe_resolve_id(selected_name, options_dict):
         return options_dict[selected_name]
     return next(iter(options_dict.values()))
 
-def _extract_joint_data(lm, w, h):
-    try:
-        shoulder_r = (lm["RIGHT_SHOULDER"][0] * w, lm["RIGHT_SHOULDER"][1] * h)
-        elbow_r = (lm["RIGHT_ELBOW"][0] * w, lm["RIGHT_ELBOW"][1] * h)
-        wrist_r = (lm["RIGHT_WRIST"][0] * w, lm["RIGHT_WRIST"][1] * h)
-        
-        shoulder_l = (lm["LEFT_SHOULDER"][0] * w, lm["LEFT_SHOULDER"][1] * h)
-        elbow_l = (lm["LEFT_ELBOW"][0] * w, lm["LEFT_ELBOW"][1] * h)
-        wrist_l = (lm["LEFT_WRIST"][0] * w, lm["LEFT_WRIST"][1] * h)
-        
-        hip_r = (lm["RIGHT_HIP"][0] * w, lm["RIGHT_HIP"][1] * h)
-        knee_r = (lm["RIGHT_KNEE"][0] * w, lm["RIGHT_KNEE"][1] * h)
-        ankle_r = (lm["RIGHT_ANKLE"][0] * w, lm["RIGHT_ANKLE"][1] * h)
-        
-        hip_l = (lm["LEFT_HIP"][0] * w, lm["LEFT_HIP"][1] * h)
-        knee_l = (lm["LEFT_KNEE"][0] * w, lm["LEFT_KNEE"][1] * h)
-        ankle_l = (lm["LEFT_ANKLE"][0] * w, lm["LEFT_ANKLE"][1] * h)
-        
-        heel_r = (lm["RIGHT_HEEL"][0] * w, lm["RIGHT_HEEL"][1] * h)
-        foot_index_r = (lm["RIGHT_FOOT_INDEX"][0] * w, lm["RIGHT_FOOT_INDEX"][1] * h)
-        heel_l = (lm["LEFT_HEEL"][0] * w, lm["LEFT_HEEL"][1] * h)
-        foot_index_l = (lm["LEFT_FOOT_INDEX"][0] * w, lm["LEFT_FOOT_INDEX"][1] * h)
-        
-        angle_arm_r = calculate_angle(shoulder_r, elbow_r, wrist_r)
-        angle_arm_l = calculate_angle(shoulder_l, elbow_l, wrist_l)
-        angle_leg_r = calculate_angle(hip_r, knee_r, ankle_r)
-        angle_leg_l = calculate_angle(hip_l, knee_l, ankle_l)
-        
-        angles = {
-            "angle_arm_r": angle_arm_r,
-            "angle_arm_l": angle_arm_l,
-            "angle_leg_r": angle_leg_r,
-            "angle_leg_l": angle_leg_l,
-        }
-        
-        symmetry_angle_arm = None
-        if angle_arm_r is not None and angle_arm_l is not None:
-            symmetry_angle_arm = abs(angle_arm_r - angle_arm_l)
-        
-        symmetry_angle_leg = None
-        if angle_leg_r is not None and angle_leg_l is not None:
-            symmetry_angle_leg = abs(angle_leg_r - angle_leg_l)
-        
-        symmetry_shoulder_y = abs(shoulder_r[1] - shoulder_l[1])
-        symmetry_elbow_y = abs(elbow_r[1] - elbow_l[1])
-        symmetry_knee_y = abs(knee_r[1] - knee_l[1])
-        
-        joint_data = {
-            "shoulder_x_r": shoulder_r[0], "shoulder_y_r": shoulder_r[1],
-            "elbow_x_r": elbow_r[0], "elbow_y_r": elbow_r[1],
-            "wrist_x_r": wrist_r[0], "wrist_y_r": wrist_r[1],
-            "angle_arm_r": angle_arm_r,
-            
-            "shoulder_x_l": shoulder_l[0], "shoulder_y_l": shoulder_l[1],
-            "elbow_x_l": elbow_l[0], "elbow_y_l": elbow_l[1],
-            "wrist_x_l": wrist_l[0], "wrist_y_l": wrist_l[1],
-            "angle_arm_l": angle_arm_l,
-            
-            "hip_x_r": hip_r[0], "hip_y_r": hip_r[1],
-            "knee_x_r": knee_r[0], "knee_y_r": knee_r[1],
-            "ankle_x_r": ankle_r[0], "ankle_y_r": ankle_r[1],
-            "angle_leg_r": angle_leg_r,
-            
-            "hip_x_l": hip_l[0], "hip_y_l": hip_l[1],
-            "knee_x_l": knee_l[0], "knee_y_l": knee_l[1],
-            "ankle_x_l": ankle_l[0], "ankle_y_l": ankle_l[1],
-            "angle_leg_l": angle_leg_l,
-            
-            "heel_x_r": heel_r[0], "heel_y_r": heel_r[1],
-            "foot_index_x_r": foot_index_r[0], "foot_index_y_r": foot_index_r[1],
-            "heel_x_l": heel_l[0], "heel_y_l": heel_l[1],
-            "foot_index_x_l": foot_index_l[0], "foot_index_y_l": foot_index_l[1],
-            
-            "symmetry_angle_arm": symmetry_angle_arm,
-            "symmetry_angle_leg": symmetry_angle_leg,
-            "symmetry_shoulder_y": symmetry_shoulder_y,
-            "symmetry_elbow_y": symmetry_elbow_y,
-            "symmetry_knee_y": symmetry_knee_y,
-        }
-        
-        return joint_data, angles
-        
-    except KeyError as e:
-        print(f"Landmarks incompletos, falta: {e}")
+_JOINT_LANDMARKS = (
+    ("RIGHT_SHOULDER", "shoulder_x_r", "shoulder_y_r"),
+    ("RIGHT_ELBOW", "elbow_x_r", "elbow_y_r"),
+    ("RIGHT_WRIST", "wrist_x_r", "wrist_y_r"),
+    ("LEFT_SHOULDER", "shoulder_x_l", "shoulder_y_l"),
+    ("LEFT_ELBOW", "elbow_x_l", "elbow_y_l"),
+    ("LEFT_WRIST", "wrist_x_l", "wrist_y_l"),
+    ("RIGHT_HIP", "hip_x_r", "hip_y_r"),
+    ("RIGHT_KNEE", "knee_x_r", "knee_y_r"),
+    ("RIGHT_ANKLE", "ankle_x_r", "ankle_y_r"),
+    ("LEFT_HIP", "hip_x_l", "hip_y_l"),
+    ("LEFT_KNEE", "knee_x_l", "knee_y_l"),
+    ("LEFT_ANKLE", "ankle_x_l", "ankle_y_l"),
+    ("RIGHT_HEEL", "heel_x_r", "heel_y_r"),
+    ("RIGHT_FOOT_INDEX", "foot_index_x_r", "foot_index_y_r"),
+    ("LEFT_HEEL", "heel_x_l", "heel_y_l"),
+    ("LEFT_FOOT_INDEX", "foot_index_x_l", "foot_index_y_l"),
+)
+_JOINT_INDICES = np.array([LANDMARK_INDEX[name] for name, _, _ in _JOINT_LANDMARKS], dtype=np.intp)
+_JOINT_KEYS = tuple(key for _, x_key, y_key in _JOINT_LANDMARKS for key in (x_key, y_key))
+# Los 12 primeros puntos siguen el orden de core.angle_kernels.ANGLE_TRIPLETS.
+_ANGLE_KEYS = ("angle_arm_r", "angle_arm_l", "angle_leg_r", "angle_leg_l")
+_RS, _RE, _LS, _LE, _RK, _LK = 0, 1, 3, 4, 7, 10
+
+
+def _extract_joint_data(landmarks, w, h):
+    if landmarks is None:
         return None, {}
 
+    pts = landmarks[_JOINT_INDICES, :2] * (w, h)
+    angles = dict(zip(_ANGLE_KEYS, map(safe_round, four_angles(pts).tolist())))
+    angle_arm_r, angle_arm_l, angle_leg_r, angle_leg_l = angles.values()
+
+    symmetry_angle_arm = None
+    if angle_arm_r is not None and angle_arm_l is not None:
+        symmetry_angle_arm = abs(angle_arm_r - angle_arm_l)
+
+    symmetry_angle_leg = None
+    if angle_leg_r is not None and angle_leg_l is not None:
+        symmetry_angle_leg = abs(angle_leg_r - angle_leg_l)
+
+    ys = pts[:, 1].tolist()
+    joint_data = dict(zip(_JOINT_KEYS, pts.ravel().tolist()))
+    joint_data.update(angles)
+    joint_data.update(
+        symmetry_angle_arm=symmetry_angle_arm,
+        symmetry_angle_leg=symmetry_angle_leg,
+        symmetry_shoulder_y=abs(ys[_RS] - ys[_LS]),
+        symmetry_elbow_y=abs(ys[_RE] - ys[_LE]),
+        symmetry_knee_y=abs(ys[_RK] - ys[_LK]),
+    )
+
+    return joint_data, angles
+
 def _preinitialize_session(patient_id, exercise_id, notes, sampling_rate,
-                          generate_raw, generate_mediapipe, generate_legacy):
+                          generate_raw, generate_mediapipe, generate_legacy,
+                          overlay_sidecar=False):
     try:
         session_mgr = SessionManager(
             output_dir="data/exports",
@@ -181,6 +182,7 @@ def _preinitialize_session(patient_id, exercise_id, notes, sampling_rate,
             generate_raw=generate_raw,
             generate_mediapipe=generate_mediapipe,
             generate_legacy=generate_legacy,
+            overlay_sidecar=overlay_sidecar,
         )
         
         DEFAULT_WIDTH = 640
@@ -220,6 +222,7 @@ class Processor(VideoProcessorBase):
             if self.detector is None:
                 log.info("Inicializando PoseDetector en thread de WebRTC...")
                 self.detector = PoseDetector()
+                warm_up_angle_kernel()
                 log.info("PoseDetector inicializado correctamente")
             
             img_bgr = frame.to_ndarray(format="bgr24")
@@ -247,13 +250,16 @@ class Processor(VideoProcessorBase):
                     frame_mediapipe = self.detector.draw_landmarks(frame_mediapipe, results)
                 _draw_sequence_text(frame_mediapipe, sequence_num)
             
+            lm = None
+            angles = {}
             frame_legacy = None
             joint_data = None
             if self.session_mgr.generate_legacy:
                 frame_legacy = image_bgr.copy()
                 if landmarks_found:
-                    lm = self.detector.extract_landmarks(results)
-                    joint_data, angles = _extract_joint_data(lm, w, h)
+                    lm_arr = self.detector.landmark_array(results)
+                    lm = self.detector.landmarks_to_dict(lm_arr)
+                    joint_data, angles = _extract_joint_data(lm_arr, w, h)
                     
                     if joint_data:
                         frame_legacy = draw_legacy_overlay(
@@ -278,13 +284,19 @@ class Processor(VideoProcessorBase):
                     if self.frame_idx % 60 == 0:
                         print(f"Error BD frame {self.frame_idx}: {e}")
 
+            if self.session_mgr.overlay_sidecar and landmarks_found and lm is None:
+                lm = self.detector.extract_landmarks(results)
+
             if self.session_mgr:
                 try:
-                    self.session_mgr.write_video_frames(
+                    raw_written = self.session_mgr.write_video_frames(
                         frame_raw=frame_raw,
                         frame_mediapipe=frame_mediapipe,
                         frame_legacy=frame_legacy
                     )
+                    # Solo se guarda el overlay de frames que llegaron al RAW.
+                    if self.session_mgr.overlay_sidecar and raw_written:
+                        self.session_mgr.record_overlay(self.frame_idx, sequence_num, lm, angles)
                     self.frame_idx += 1
                 except Exception as e:
                     if self.frame_idx % 60 == 0:
@@ -333,7 +345,7 @@ class Processor(VideoProcessorBase):
                     print(f"Sesión {sid} descartada")
                 except Exception:
                     pass
-            for path in paths:
+            for path in (*paths, self.session_mgr.get_overlay_path()):
                 if path and os.path.exists(path):
                     try:
                         os.remove(path)
@@ -421,6 +433,12 @@ def app():
             else:
                 sampling_rate = 0.0
             
+            overlay_sidecar = st.checkbox(
+                "Guardar overlays como datos (un solo encoder)",
+                help="Codifica solo el vídeo RAW y guarda landmarks/ángulos en un fichero aparte; "
+                     "las versiones MediaPipe y clínica se regeneran bajo demanda"
+            )
+            
             st.info(f"Los videos se grabarán a {TARGET_FPS} fps para óptima calidad y velocidad correcta")
 
         if source_mode == "Webcam (WebRTC)" and not _WEBRTC_OK:
@@ -440,6 +458,7 @@ def app():
                 st.session_state["generate_raw"] = generate_raw
                 st.session_state["generate_mediapipe"] = generate_mediapipe
                 st.session_state["generate_legacy"] = generate_legacy
+                st.session_state["overlay_sidecar"] = overlay_sidecar
                 st.session_state["record_mode"] = True
                 st.session_state["paused"] = False
                 st.session_state["save_prompt"] = False
@@ -517,12 +536,13 @@ def app():
         gen_raw = st.session_state.get("generate_raw", False)
         gen_mp = st.session_state.get("generate_mediapipe", False)
         gen_leg = st.session_state.get("generate_legacy", True)
+        sidecar = st.session_state.get("overlay_sidecar", False)
         
         if "webrtc_session_mgr" not in st.session_state:
             with st.spinner("Preparando sistema de grabación..."):
                 try:
                     session_mgr = _preinitialize_session(
-                        pid, eid, nts, sr, gen_raw, gen_mp, gen_leg
+                        pid, eid, nts, sr, gen_raw, gen_mp, gen_leg, sidecar
                     )
                     st.session_state["webrtc_session_mgr"] = session_mgr
                     st.success("Sistema listo para grabar")
@@ -551,6 +571,9 @@ def app():
             desired_playing_state=True,
         )
 
+        if session_mgr.video_stopped_low_disk:
+            st.warning(LOW_DISK_WARNING)
+
         if st.session_state.get("save_prompt"):
             st.markdown("---")
             st.markdown("### Finalizar sesión")
@@ -585,6 +608,8 @@ def app():
                                     st.caption(f"MediaPipe: {os.path.basename(mp_path)}")
                                 if leg_path: 
                                     st.caption(f"Clínico: {os.path.basename(leg_path)}")
+                                if session_mgr.video_stopped_low_disk:
+                                    st.warning(LOW_DISK_WARNING)
                                 time.sleep(1.5)
                         
                         if "webrtc_session_mgr" in st.session_state:
@@ -729,6 +754,7 @@ def app():
                                     gen_raw = st.session_state.get("generate_raw", False)
                                     gen_mp = st.session_state.get("generate_mediapipe", False)
                                     gen_leg = st.session_state.get("generate_legacy", True)
+                                    sidecar = st.session_state.get("overlay_sidecar", False)
 
                                     original_fps = cap.fps
                                     st.info(f"Procesando video: {original_fps:.1f} fps")
@@ -742,47 +768,70 @@ def app():
                                         generate_raw=gen_raw,
                                         generate_mediapipe=gen_mp,
                                         generate_legacy=gen_leg,
+                                        overlay_sidecar=sidecar,
+                                        realtime=False,
                                     )
                                     sid = sess.start_session(cap.width, cap.height, original_fps)
 
                                     detector = PoseDetector()
+                                    warm_up_angle_kernel()
                                     total_frames = int(cap.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
                                     prog = st.progress(0)
                                     idx = 0
+                                    first_sequence = sess.get_sequence_counter()
+                                    # En modo sidecar solo se codifica el RAW; los overlays se regeneran luego.
+                                    encode_raw = sess.generate_raw
+                                    encode_mp = gen_mp and not sidecar
+                                    encode_leg = gen_leg and not sidecar
+
+                                    write_q = queue.Queue(maxsize=ANALYSIS_QUEUE_SIZE)
+                                    writer = threading.Thread(
+                                        target=_session_writer, args=(sess, write_q),
+                                        name="analysis-writer", daemon=True
+                                    )
+                                    writer.start()
+                                    try:
+                                        cap.start()
 
-                                    while True:
-                                        ret, frame = cap.read_frame()
-                                        if not ret:
-                                            break
+                                        while True:
+                                            ret, frame = cap.read_frame()
+                                            if not ret:
+                                                break
 
-                                        h, w = frame.shape[:2]
+                                            h, w = frame.shape[:2]
                                         
-                                        sequence_num = sess.get_sequence_counter()
+                                            sequence_num = first_sequence + idx
                                         
-                                        frame_raw = None
-                                        if gen_raw:
-                                            frame_raw = frame.copy()
-                                            _draw_sequence_text(frame_raw, sequence_num)
+                                            frame_raw = None
+                                            if encode_raw:
+                                                frame_raw = frame.copy()
+                                                _draw_sequence_text(frame_raw, sequence_num)
                                         
-                                        image_bgr, results = detector.process_frame(frame)
+                                            image_bgr, results = detector.process_frame(frame)
+                                            landmarks_found = bool(results and results.pose_landmarks)
                                         
-                                        frame_mediapipe = None
-                                        if gen_mp:
-                                            if results and results.pose_landmarks:
-                                                frame_mediapipe = detector.draw_mediapipe_on_white_background(
-                                                    w, h, results, sequence=sequence_num
-                                                )
-                                            else:
-                                                frame_mediapipe = np.ones((h, w, 3), dtype=np.uint8) * 255
-                                                _draw_sequence_text(frame_mediapipe, sequence_num)
+                                            frame_mediapipe = None
+                                            if encode_mp:
+                                                if landmarks_found:
+                                                    frame_mediapipe = detector.draw_mediapipe_on_white_background(
+                                                        w, h, results, sequence=sequence_num
+                                                    )
+                                                else:
+                                                    frame_mediapipe = np.ones((h, w, 3), dtype=np.uint8) * 255
+                                                    _draw_sequence_text(frame_mediapipe, sequence_num)
                                         
-                                        frame_legacy = None
-                                        if gen_leg:
-                                            frame_legacy = image_bgr.copy()
-                                            if results and results.pose_landmarks:
-                                                lm = detector.extract_landmarks(results)
-                                                joint_data, angles = _extract_joint_data(lm, w, h)
-                                                
+                                            lm = None
+                                            angles = {}
+                                            joint_data = None
+                                            if landmarks_found and (gen_leg or sidecar):
+                                                lm_arr = detector.landmark_array(results)
+                                                lm = detector.landmarks_to_dict(lm_arr)
+                                                if gen_leg:
+                                                    joint_data, angles = _extract_joint_data(lm_arr, w, h)
+
+                                            frame_legacy = None
+                                            if encode_leg:
+                                                frame_legacy = image_bgr.copy()
                                                 if joint_data:
                                                     frame_legacy = draw_legacy_overlay(
                                                         frame_legacy, lm, w, h,
@@ -790,32 +839,22 @@ def app():
                                                         a_max=60.0,
                                                         sequence=sequence_num
                                                     )
-                                                    
-                                                    try:
-                                                        sess.record_frame_data(
-                                                            frame_index=idx,
-                                                            elapsed_time=sess.elapsed_time(),
-                                                            joints=joint_data
-                                                        )
-                                                    except Exception as e:
-                                                        print(f"Error al registrar frame {idx}: {e}")
                                                 else:
                                                     _draw_sequence_text(frame_legacy, sequence_num)
-                                            else:
-                                                _draw_sequence_text(frame_legacy, sequence_num)
-
-                                        sess.write_video_frames(
-                                            frame_raw=frame_raw,
-                                            frame_mediapipe=frame_mediapipe,
-                                            frame_legacy=frame_legacy
-                                        )
-                                        
-                                        idx += 1
-                                        prog.progress(min(idx / total_frames, 1.0))
 
-                                    sess.close_session()
-                                    cap.release()
-                                    detector.release()
+                                            write_q.put((
+                                                idx, sess.elapsed_time(), joint_data, lm, angles,
+                                                frame_raw, frame_mediapipe, frame_legacy
+                                            ))
+                                        
+                                            idx += 1
+                                            prog.progress(min(idx / total_frames, 1.0))
+                                    finally:
+                                        write_q.put(None)
+                                        writer.join()
+                                        sess.close_session()
+                                        cap.release()
+                                        detector.release()
                                     
                                     try:
                                         Path(temp_path).unlink()
@@ -827,6 +866,9 @@ def app():
                                     if raw_path: st.info(f"RAW: {os.path.basename(raw_path)}")
                                     if mp_path: st.info(f"MediaPipe: {os.path.basename(mp_path)}")
                                     if leg_path: st.info(f"Clínico: {os.path.basename(leg_path)}")
+                                    if sess.video_stopped_low_disk:
+                                        st.warning(LOW_DISK_WARNING)
+                                        time.sleep(3)
                                     
                                     st.session_state.validation_result = None
                                     _reset_record_ui_state()